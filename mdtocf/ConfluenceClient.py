@@ -0,0 +1,194 @@
+"""Confluence REST API Client
+
+Used by ConfluencePublisher to talk to Confluence. Extends the Atlassian
+Python API client to count the requests issued per run (by method and
+endpoint, with their latency and bytes uploaded) and to update a page
+by its known id and version with a single request.
+
+Also fetches all the descendant pages of a page with paginated requests.
+
+Requests share a pool of keep-alive connections, at most max_connections
+are in flight at once (across publisher threads). Throttled (429) and
+failed (5xx, connection errors) requests are retried honoring the
+Retry-After header, or else with jittered exponential backoff. POST
+requests (creating pages, uploading attachments) may have been applied
+when they fail, they are only retried when throttled (429), unavailable
+(503) or not sent (connection refused or timed out).
+
+"""
+import collections
+import email.utils
+import random
+import re
+import requests
+import threading
+import time
+
+from atlassian import Confluence
+from atlassian.confluence import ApiError
+from requests import HTTPError
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+CONTENT_ID_PATTERN = re.compile(r'/(?:att)?\d+(?=/|$)')
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# Not idempotent, retried only when Confluence did not process them
+POST_RETRY_STATUS_CODES = (429, 503)
+
+MAX_RETRY_DELAY = 120
+
+# Errors raised by the client for a failed request (the response of an
+# ApiError is in its reason)
+API_ERRORS = (HTTPError, ApiError)
+
+
+def endpoint(method, path):
+    path = CONTENT_ID_PATTERN.sub('/{id}', '/' + path.strip('/'))
+    return '{} {}'.format(method, path)
+
+
+def sent(ex):
+    # Connection errors raised before sending the request are not
+    if isinstance(ex, requests.ConnectTimeout):
+        return False
+    reason = ex.args[0] if ex.args else None
+    reason = getattr(reason, 'reason', reason)
+    return not isinstance(reason, NewConnectionError)
+
+
+def retry_after(response):
+    value = response.headers.get('Retry-After') if response is not None \
+        else None
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, date.timestamp() - time.time())
+
+
+def retry_delay(response, attempt, backoff):
+    delay = retry_after(response)
+    if delay is None:
+        # Full jitter: spread retries of concurrent requests
+        delay = random.uniform(0, backoff * 2 ** attempt)
+    return min(delay, MAX_RETRY_DELAY)
+
+
+class ConfluenceClient(Confluence):
+
+    def __init__(self, *args, max_connections=10, retries=5, backoff=1.0,
+                 **kwargs):
+        super(ConfluenceClient, self).__init__(*args, **kwargs)
+        self.calls = collections.Counter()
+        self.retried = collections.Counter()
+        self.seconds = collections.Counter()
+        self.max_seconds = collections.Counter()
+        self.uploaded = collections.Counter()
+        self.calls_lock = threading.Lock()
+        self.retries = retries
+        self.backoff = backoff
+        self.connections = threading.BoundedSemaphore(max_connections)
+
+        adapter = HTTPAdapter(pool_connections=max_connections,
+                              pool_maxsize=max_connections)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+    def request(self, method='GET', path='/', *args, **kwargs):
+        name = endpoint(method, path)
+        with self.calls_lock:
+            self.calls[name] += 1
+
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                with self.connections:
+                    response = super(ConfluenceClient, self).request(
+                        method, path, *args, **kwargs)
+                self.__record(name, start, response)
+                return response
+            except HTTPError as ex:
+                self.__record(name, start, ex.response)
+                status_codes = POST_RETRY_STATUS_CODES \
+                    if method == 'POST' else RETRY_STATUS_CODES
+                if attempt >= self.retries or ex.response is None \
+                   or ex.response.status_code not in status_codes:
+                    raise
+                delay = retry_delay(ex.response, attempt, self.backoff)
+            except (requests.ConnectionError, requests.Timeout) as ex:
+                self.__record(name, start, None)
+                if attempt >= self.retries or \
+                   (method == 'POST' and sent(ex)):
+                    raise
+                delay = retry_delay(None, attempt, self.backoff)
+
+            with self.calls_lock:
+                self.retried[name] += 1
+            attempt += 1
+            time.sleep(delay)
+
+    def __record(self, name, start, response):
+        seconds = time.perf_counter() - start
+        size = 0
+        if response is not None and response.request is not None:
+            size = int(response.request.headers.get('Content-Length') or 0)
+        with self.calls_lock:
+            self.seconds[name] += seconds
+            self.max_seconds[name] = max(self.max_seconds[name], seconds)
+            self.uploaded[name] += size
+
+    def stats(self):
+        with self.calls_lock:
+            return {name: {'calls': self.calls[name],
+                           'retries': self.retried[name],
+                           'seconds': self.seconds[name],
+                           'max_seconds': self.max_seconds[name],
+                           'bytes': self.uploaded[name]}
+                    for name in self.calls}
+
+    def reset_stats(self):
+        with self.calls_lock:
+            for counter in (self.calls, self.retried, self.seconds,
+                            self.max_seconds, self.uploaded):
+                counter.clear()
+
+    def get_descendant_pages(self, page_id, limit=200):
+        url = 'rest/api/content/{}/descendant/page'.format(page_id)
+        start = 0
+        while True:
+            response = self.get(url, params={
+                'start': start,
+                'limit': limit,
+                'expand': 'version,ancestors'
+            }) or {}
+            results = response.get('results') or []
+            for page in results:
+                yield page
+            if not results or 'next' not in (response.get('_links') or {}):
+                break
+            start += len(results)
+
+    def get_page_version(self, page_id):
+        page = self.get('rest/api/content/{}'.format(page_id),
+                        params={'expand': 'version'}) or {}
+        return (page.get('version') or {}).get('number')
+
+    def update_page_by_id(self, page_id, version, title, body,
+                          parent_id=None, representation='storage'):
+        data = {
+            'id': page_id,
+            'type': 'page',
+            'title': title,
+            'body': self._create_body(body, representation),
+            'version': {'number': version + 1, 'minorEdit': False}
+        }
+        if parent_id:
+            data['ancestors'] = [{'type': 'page', 'id': parent_id}]
+        return self.put('rest/api/content/{}'.format(page_id), data=data)
@@ -4,20 +4,30 @@ Encapsulate the logic of processing a markdown directory tree.
 
 """
 import hashlib
-import mistune
+import json
+import logging
 import os
+import threading
+import time
 
-from mistune.directives import DirectiveInclude
-from .AdmonitionsDirective import Admonition
-from .HTMLCommentPlugin import plugin_html_comment
-from .HugoRefLinkPlugin import HugoRefLinkPlugin
-from .FrontMatterPlugin import plugin_front_matter
+from concurrent.futures import Future, ProcessPoolExecutor, \
+    ThreadPoolExecutor
+
+from .FrontMatterPlugin import FrontMatterIndex
+from .GitChanges import GitChanges
 from .ConfluenceRenderer import ConfluenceRenderer, generate_autoindex
+from .MarkdownRenderer import create_renderer, init_render_worker, \
+    render_markdown, render_markdown_worker, share_renderer
 from .KeyValue import KeyValue
-from atlassian import Confluence
-from atlassian.confluence import ApiError
-from requests import HTTPError
-from .utilities import getFileContent
+from .PageIndex import PageIndex
+from .PublishPlan import PublishPlan
+from .RenderCache import RenderCache
+from .RunReport import RunReport
+from .SourceBuffer import SourceBuffer
+
+log = logging.getLogger(__name__)
+
+RACY_NS = 2 * 10**9
 
 
 def sha256(value):
@@ -25,8 +35,52 @@ def sha256(value):
     return h.hexdigest()
 
 
-def get_file_sha256(filepath):
-    return sha256(getFileContent(filepath))
+def get_page_sha256(title, parentid, body):
+    # Hash what is pushed to Confluence, not the markdown source, so that
+    # ref link titles, includes, title prefix and renderer changes count
+    return sha256('{}\n{}\n{}'.format(title, parentid, body))
+
+
+def get_file_sha256(filepath, chunk_size=65536):
+    # Stream files (images, pdf, etc.) instead of loading them whole
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def status_code(ex):
+    # HTTPError has the response, ApiError wraps the HTTPError as reason
+    response = getattr(ex, 'response', None)
+    if response is None:
+        response = getattr(getattr(ex, 'reason', None), 'response', None)
+    return response.status_code if response is not None else None
+
+
+def is_not_found(ex):
+    return status_code(ex) == 404
+
+
+def stat_signature(stat):
+    # Unchanged file: same modification time, size and inode. Files
+    # modified in the last seconds are hashed again next run (racy)
+    if stat is None or time.time_ns() - stat.st_mtime_ns < RACY_NS:
+        return None
+    return [stat.st_mtime_ns, stat.st_size, stat.st_ino]
+
+
+def page_version(result):
+    return (result.get('version') or {}).get('number')
+
+
+class ParentPageNotFoundError(Exception):
+    def __init__(self, parentpath):
+        self.parentpath = parentpath
+
+    def __str__(self):
+        return 'Parent page not found in Confluence: {}'.format(
+            self.parentpath)
 
 
 class ConfluencePublisher():
@@ -35,175 +89,775 @@ class ConfluencePublisher():
             self, url, username, api_token,
             page_title_prefix, markdown_dir, db_path, space, parent_pageid,
             force_update=False, force_delete=False, skip_update=False,
-            verbose=False):
-
-        self.api = Confluence(url=url, username=username, password=api_token)
+            jobs=1, render_only=None, render_jobs=1,
+            max_connections=10, retries=5, trace=(), render_cache=None,
+            render_cache_size=256 * 1024 * 1024, paranoid=False, since=None,
+            resume=False):
+
+        # Render only: write storage XHTML to a directory, no API calls
+        self.render_only = render_only
+        self.manifest = {}
+        self.remote_pages = None
+        self.remote_pages_lock = threading.Lock()
+        self.api = None
+        self.api_errors = ()
+        self.kv = None
+        if render_only is None:
+            # Imported to publish only, rendering starts faster without
+            from .ConfluenceClient import API_ERRORS, ConfluenceClient
+            self.api_errors = API_ERRORS
+            self.api = ConfluenceClient(
+                url=url, username=username, password=api_token,
+                max_connections=max_connections, retries=retries)
+            self.kv = KeyValue(db_path)
         self.page_title_prefix = page_title_prefix
         self.markdown_dir = markdown_dir
-        self.kv = KeyValue(db_path)
         self.space = space
         self.parent_pageid = parent_pageid
         self.force_update = force_update
         self.force_delete = force_delete
         self.skip_update = skip_update
-        self.confluence_renderer = ConfluenceRenderer(verbose)
-        self.renderer = mistune.create_markdown(
-            renderer=self.confluence_renderer,
-            plugins=[
-                plugin_front_matter,
-                DirectiveInclude(),
-                HugoRefLinkPlugin(self.markdown_dir),
-                'strikethrough',
-                'footnotes',
-                'table',
-                'url',
-                Admonition(),
-                plugin_html_comment,
-            ]
-        )
-
-    def __update_page(self, space, parentid, filepath, autoindex=False):
-
-        metadata = self.kv.load(filepath)
-
-        current_title = metadata['title']
-        current_hash = metadata['sha256']
-        sha_hash = get_file_sha256(filepath)
+        self.render_key = sha256('{}\n{}'.format(
+            page_title_prefix, ConfluenceRenderer.VERSION))
+        self.paranoid = paranoid
+        self.sources = {}
+        self.stats = {}
+        self.dirty = set()
+        self.jobs = jobs
+        self.executor = None
+        self.futures = []
+        self.futures_lock = threading.Lock()
+        self.parents_lock = threading.RLock()
+        self.report = RunReport(markdown_dir)
+        self.source_buffer = SourceBuffer(self.report)
+        self.front_matter_index = FrontMatterIndex(
+            lambda filepath: self.source_buffer.read(filepath, keep=False))
+        self.renderer = create_renderer(
+            self.markdown_dir, self.front_matter_index, trace)
+        self.trace = trace
+        self.render_jobs = render_jobs
+        self.rendering = {}
+        self.plan = None
+        self.render_cache = None
+        if render_cache:
+            self.render_cache = RenderCache(render_cache, render_cache_size)
+        self.file_hashes = {}
+        # Operations done by an interrupted run (--resume)
+        self.resume = resume
+        self.journal = None
+        # Publish only files changed since a git revision
+        self.changes = None
+        if since and render_only is None:
+            self.changes = GitChanges(markdown_dir, since)
+
+    def __event(self, event, filepath, title, page_id=None,
+                level=logging.INFO):
+        # Page level events, as structured records (title, path, id)
+        if not log.isEnabledFor(level):
+            return
+        fields = {'title': title}
+        if filepath is not None:
+            fields['path'] = os.path.relpath(filepath, self.markdown_dir)
+        if page_id is None:
+            log.log(level, '%s => Title: %s', event, title,
+                    extra={'event': event, 'fields': fields})
+        else:
+            fields['id'] = page_id
+            log.log(level, '%s => Id: %s, Title: %s', event, page_id, title,
+                    extra={'event': event, 'fields': fields})
+
+    def __submit(self, fn, *args):
+        # Run inline unless publishing with a worker pool (--jobs > 1)
+        if self.executor is None:
+            fn(*args)
+        else:
+            with self.futures_lock:
+                self.futures.append(self.executor.submit(fn, *args))
+
+    def __remote(self):
+        # Pages under the parent page, fetched at first need
+        with self.remote_pages_lock:
+            if self.remote_pages is None:
+                self.remote_pages = PageIndex(
+                    self.api.get_descendant_pages(self.parent_pageid))
+            return self.remote_pages
+
+    def __start_journal(self):
+        if self.journal is not None:
+            return
+
+        journal = self.kv.journal()
+        run = journal.get(('run', ''))
+        if self.resume and run is not None and run[1] != 'done':
+            self.journal = dict((key, sha_hash) for key, (sha_hash, state)
+                                in journal.items() if state == 'done')
+            log.info('RES => Operations: %s', len(self.journal),
+                     extra={'event': 'RES',
+                            'fields': {'operations': len(self.journal)}})
+        else:
+            self.kv.clear_journal()
+            self.journal = {}
+        self.kv.journal_planned('run', '')
+
+    def __completed(self, operation, filepath, sha_hash):
+        # Done by the interrupted run, same content (--resume)
+        return self.journal is not None and sha_hash is not None \
+            and self.journal.get((operation, filepath)) == sha_hash
+
+    def __publish_plan(self):
+        # Walked once per run, shared by delete() and publish()
+        if self.plan is None:
+            if self.changes is None:
+                self.plan = PublishPlan(self.markdown_dir)
+            else:
+                self.plan = PublishPlan(self.markdown_dir,
+                                        self.__changed_paths())
+        return self.plan
+
+    def __changed_paths(self):
+        # Changed files and the pages linking to or including them
+        paths = set(self.changes.changed)
+        removed = self.changes.deleted | set(self.changes.renamed)
+        for path in removed:
+            # _index.md removed from a directory kept: autoindex page
+            if os.path.basename(path) == '_index.md' \
+               and os.path.isdir(os.path.dirname(path)):
+                paths.add(path)
+                self.dirty.add(os.path.normpath(path))
+        pending = [os.path.normpath(path) for path in paths | removed]
+        seen = set(pending)
+        while pending:
+            for source in self.kv.dependents(pending.pop()):
+                if os.path.normpath(source) not in seen:
+                    seen.add(os.path.normpath(source))
+                    paths.add(source)
+                    pending.append(os.path.normpath(source))
+        return paths
+
+    def __removed_paths(self):
+        # Deleted files, with the directory pages of removed directories
+        removed = set()
+        for path in self.changes.deleted | set(self.changes.renamed):
+            directory = os.path.dirname(path)
+            if os.path.basename(path) != '_index.md' \
+               or not os.path.isdir(directory):
+                removed.add(os.path.normpath(path))
+            while not os.path.isdir(directory) and \
+                    os.path.normpath(directory) != \
+                    os.path.normpath(self.markdown_dir):
+                removed.add(os.path.normpath(
+                    os.path.join(directory, '_index.md')))
+                directory = os.path.dirname(directory)
+        return removed
+
+    def __move_renamed(self):
+        # Renamed pages keep their Confluence page, moved when published
+        for old, new in sorted(self.changes.renamed.items()):
+            metadata = self.kv.load(old)
+            if not old.endswith('.md') or not metadata['id'] \
+               or self.kv.load(new)['id']:
+                continue
+            self.__event('MOV', new, metadata['title'], str(metadata['id']))
+            self.kv.save(new, metadata)
+            self.kv.remove(old)
+            self.dirty.add(os.path.normpath(old))
+
+    def __lookup_page_id(self, space, filepath, title):
+        # Ask Confluence only when the stored page id is missing or stale
+        page = self.__remote().find(title)
+        page_id = page['id'] if page else None
+        if page_id:
+            metadata = self.kv.load(filepath)
+            metadata['id'] = page_id
+            self.kv.save(filepath, metadata)
+        return page_id
+
+    def __with_parent(self, space, parentid, parentpath, write):
+        try:
+            return write(parentid)
+        except self.api_errors as ex:
+            if parentpath is None or not is_not_found(ex):
+                raise
+        # Stored parent page id is stale (e.g. page removed in Confluence)
+        return write(self.__republish_parent(space, parentid, parentpath))
+
+    def __republish_parent(self, space, parentid, parentpath):
+        # Parent page found by title, or published again once for all its
+        # childs (and its own parent first, if also removed)
+        with self.parents_lock:
+            metadata = self.kv.load(parentpath)
+            if metadata['id'] and metadata['id'] != parentid:
+                # Already published again for a sibling
+                return metadata['id']
+            if self.remote_pages is not None:
+                self.remote_pages.remove(parentid)
+            page_id = self.__lookup_page_id(space, parentpath,
+                                            metadata['title'])
+
+            node = self.__publish_plan().by_path.get(parentpath)
+            if not page_id and node is not None:
+                grandparentid = self.parent_pageid
+                if node.parent is not None:
+                    grandparentid = self.kv.load(node.parent)['id']
+                metadata.update(id=None, version=None, sha256='')
+                self.kv.save(parentpath, metadata)
+                if grandparentid:
+                    page_id = self.__update_page(
+                        space, grandparentid, parentpath,
+                        node.kind == 'autoindex', node.parent)
+
+            if not page_id:
+                raise ParentPageNotFoundError(
+                    os.path.relpath(parentpath, self.markdown_dir))
+            return page_id
+
+    def __write_page(self, space, parentid, parentpath, metadata, title,
+                     body):
+        page_id = metadata['id']
+        version = metadata.get('version')
+        if not page_id or not version:
+            # Not stored (e.g. older database), look in the page tree
+            page = (page_id and self.__remote().get(page_id)) \
+                or self.__remote().find(title)
+            page_id = page['id'] if page else None
+            version = page['version'] if page else None
+
+        result = None
+        if page_id and version:
+            # Update by the known page id, no title lookups
+            try:
+                result = self.api.update_page_by_id(
+                    page_id, version, title, body, parent_id=parentid)
+            except self.api_errors as ex:
+                if status_code(ex) == 409:
+                    # Edited in Confluence, update its latest version by
+                    # id (the page may have another title)
+                    result = self.api.update_page_by_id(
+                        page_id, self.api.get_page_version(page_id),
+                        title, body, parent_id=parentid)
+                elif status_code(ex) != 404:
+                    # Page removed (404) in Confluence is created again
+                    raise
+
+        if not result:
+            result = self.__with_parent(
+                space, parentid, parentpath,
+                lambda parent_id: self.api.update_or_create(
+                    parent_id=parent_id,
+                    title=title,
+                    body=body,
+                    representation='storage'
+                ))
+
+        if result and self.remote_pages is not None:
+            self.remote_pages.add(result['id'], title, page_version(result),
+                                  parentid)
+        return result
+
+    def __needs_render(self, filepath, metadata):
+        return self.force_update or not metadata['id'] \
+            or metadata.get('render') != self.render_key \
+            or os.path.normpath(filepath) in self.dirty
+
+    def __start_rendering(self, filepaths):
+        # Render pages ahead in worker processes (--render-jobs > 1),
+        # publishing consumes the results while walking the tree
+        if self.render_jobs <= 1:
+            return None
+        filepaths = [filepath for filepath in filepaths
+                     if self.__cached(filepath) is None]
+        if not filepaths:
+            return None
 
-        # --- Render (BEGIN)
+        # Rendered here first: compiles the pipeline for forked workers
+        first, filepaths = filepaths[0], filepaths[1:]
+        self.rendering[os.path.normpath(first)] = self.__render_ahead(first)
+        share_renderer(self.renderer)
+
+        executor = ProcessPoolExecutor(
+            max_workers=self.render_jobs,
+            initializer=init_render_worker,
+            initargs=(self.markdown_dir, self.trace))
+        for filepath in filepaths:
+            text = self.source_buffer.read(filepath)
+            self.source_buffer.release(filepath)
+            self.rendering[os.path.normpath(filepath)] = executor.submit(
+                render_markdown_worker, filepath, text)
+        return executor
+
+    def __render_ahead(self, filepath):
+        future = Future()
+        text = self.source_buffer.read(filepath)
+        self.source_buffer.release(filepath)
+        start = time.perf_counter()
+        try:
+            result = render_markdown(self.renderer, filepath, text)
+        except Exception as ex:
+            future.set_exception(ex)
+        else:
+            future.set_result(result + (time.perf_counter() - start,))
+        return future
+
+    def __dependency_state(self, target, kind):
+        # What a page renders from a dependency: title or included bytes
+        if kind == 'include':
+            if not os.path.isfile(target):
+                return 'missing'
+            if target not in self.file_hashes:
+                self.file_hashes[target] = get_file_sha256(target)
+            return self.file_hashes[target]
+        if os.path.isfile(target):
+            try:
+                front_matter = self.front_matter_index.load(target) or {}
+            except Exception:
+                return 'invalid'
+            return 'title:{}'.format(front_matter.get('title'))
+        if os.path.isdir(os.path.dirname(target)):
+            return 'autoindex'
+        return 'missing'
+
+    def __cache_key(self, filepath, dependencies):
+        lines = [self.render_key, os.path.normpath(filepath),
+                 self.sources.get(filepath)
+                 or self.source_buffer.sha256(filepath)]
+        for target, kind in sorted(dependencies.items()):
+            lines.append('{} {} {}'.format(
+                kind, target, self.__dependency_state(target, kind)))
+        return sha256('\n'.join(lines))
+
+    def __cached(self, filepath):
+        # Rendered by a previous run from the same source and dependencies
+        if self.render_cache is None:
+            return None
+        dependencies = self.render_cache.dependencies(
+            os.path.normpath(filepath))
+        return self.render_cache.get(
+            self.__cache_key(filepath, dependencies))
 
+    def __render_page(self, filepath, autoindex):
         body = ''
-        state = {'front_matter': {}}
+        dependencies = {}
 
         if autoindex:
             body = generate_autoindex()
-            state['front_matter']['title'] = \
-                os.path.basename(os.path.dirname(filepath)).title()
+            title = os.path.basename(os.path.dirname(filepath)).title()
         else:
             if filepath.endswith("_index.md"):
                 body = generate_autoindex()
-            body += self.renderer.read(filepath, state)
+            future = self.rendering.pop(os.path.normpath(filepath), None)
+            cached = self.__cached(filepath)
+            if cached is not None:
+                title, page_body, dependencies = cached
+                self.source_buffer.release(filepath)
+            else:
+                if future is not None:
+                    title, page_body, dependencies, seconds = \
+                        future.result()
+                    self.report.add(filepath, 'render', seconds)
+                else:
+                    text = self.source_buffer.read(filepath)
+                    with self.report.measure(filepath, 'render'):
+                        title, page_body, dependencies = render_markdown(
+                            self.renderer, filepath, text)
+                    self.source_buffer.release(filepath)
+                if self.render_cache is not None:
+                    self.render_cache.put(
+                        self.__cache_key(filepath, dependencies),
+                        os.path.normpath(filepath), title, page_body,
+                        dependencies)
+            body += page_body
+
+        title = '{}{}'.format(self.page_title_prefix, title)
+
+        return title, body, dependencies
+
+    def __render_page_to_file(self, parentid, filepath, autoindex):
+        title, body, dependencies = self.__render_page(filepath, autoindex)
+
+        relpath = os.path.relpath(filepath, self.markdown_dir)
+        output_path = os.path.join(
+            self.render_only, os.path.splitext(relpath)[0] + '.xhtml')
+        with self.report.measure(filepath, 'write'):
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            with open(output_path, 'w', encoding='utf-8') as file:
+                file.write(body)
+
+        self.__event('OUT', filepath, title)
+        with self.futures_lock:
+            self.manifest[relpath] = {
+                'kind': 'autoindex' if autoindex else 'page',
+                'title': title,
+                'parent': parentid,
+                'sha256': get_page_sha256(title, parentid, body),
+                'dependencies': sorted(
+                    os.path.relpath(target, self.markdown_dir)
+                    for target in dependencies)
+            }
+
+        # Source path (relative) stands for the page id of childs
+        return relpath
+
+    def __update_page(self, space, parentid, filepath, autoindex=False,
+                      parentpath=None):
+
+        if self.render_only is not None:
+            return self.__render_page_to_file(parentid, filepath, autoindex)
 
-        title = '{}{}'.format(self.page_title_prefix,
-                              state['front_matter']['title'])
+        metadata = self.kv.load(filepath)
 
-        # --- Render (END)
+        current_title = metadata['title']
+        current_hash = metadata['sha256']
+
+        # Source and its dependencies unchanged, skip rendering
+        if not autoindex and metadata.get('parent') == parentid \
+           and not self.__needs_render(filepath, metadata):
+            self.__event('SKP', filepath, current_title)
+            return metadata['id']
+
+        title, body, dependencies = self.__render_page(filepath, autoindex)
+        self.__event('RND', filepath, title, level=logging.DEBUG)
+
+        sha_hash = get_page_sha256(title, parentid, body)
+        states = None
+        if not autoindex:
+            self.kv.save_dependencies(filepath, dependencies)
+            # Compared by the next runs, dependencies outside the plan
+            states = {target: [kind, self.__dependency_state(target, kind)]
+                      for target, kind in dependencies.items()}
+
+        record = {'id': metadata['id'],
+                  'title': title,
+                  'sha256': sha_hash,
+                  'version': metadata.get('version'),
+                  'parent': parentid,
+                  'source': self.sources.get(filepath),
+                  'stat': self.stats.get(filepath),
+                  'render': self.render_key,
+                  'dependencies': states}
 
         if current_title and current_title != title:
-            print('REN => Title: ' + title)
-            confluence_page_id = self.api.get_page_id(space, current_title)
-            self.api.update_page(confluence_page_id, title, body)
+            self.__event('REN', filepath, title)
 
-        if current_hash != sha_hash or self.force_update:
+        if (current_hash != sha_hash or self.force_update) \
+           and not self.__completed('page', filepath, sha_hash):
             if autoindex:
-                print('IDX => Title: ' + title)
+                self.__event('IDX', filepath, title)
             else:
-                print('UPD => Title: ' + title)
-
-            if self.api.update_or_create(
-                parent_id=parentid,
-                title=title,
-                body=body,
-                representation='storage'
-            ):
-                confluence_page_id = self.api.get_page_id(space, title)
-                self.kv.save(filepath,
-                             {'id': confluence_page_id, 'title': title, 'sha256': sha_hash})
-                return confluence_page_id
+                self.__event('UPD', filepath, title)
+
+            self.kv.journal_planned('page', filepath, sha_hash)
+            with self.report.measure(filepath, 'push'):
+                result = self.__write_page(
+                    space, parentid, parentpath, metadata, title, body)
+            if result:
+                record['id'] = result['id']
+                record['version'] = page_version(result)
+                self.kv.save(filepath, record)
+                self.kv.journal_done('page', filepath, sha_hash)
+                return record['id']
 
             return None
         else:
-            print('SKP => Title: ' + title)
-            return self.api.get_page_id(space, title)
+            self.__event('SKP', filepath, title)
+            if record != metadata:
+                self.kv.save(filepath, record)
+            if metadata['id']:
+                return metadata['id']
+            return self.__lookup_page_id(space, filepath, title)
 
     def __delete_attachment(self, filepath):
         metadata = self.kv.load(filepath)
         filename = os.path.basename(filepath)
         if metadata['id']:
             try:
-                print('DEL Att. => Title: ' + filename)
+                self.__event('DEL Att.', filepath, filename)
                 # https://confluence.atlassian.com/confkb/confluence-rest-api-lacks-delete-method-for-attachments-715361922.html
                 # self.api.delete_attachment_by_id(metadata['id'], 1)
                 self.api.remove_content(metadata['id'])
-            except (HTTPError, ApiError):
+            except self.api_errors:
                 pass
 
-    def __update_attachment(self, space, pageid, filepath):
+    def __update_attachment(self, space, pageid, filepath, parentpath=None,
+                            sha_hash=None):
         filename = os.path.basename(filepath)
 
-        print('UPD Att. => Title: ' + filename)
-        results = self.api.attach_file(filepath,
-                                       name=filename,
-                                       page_id=pageid,
-                                       space=space)
+        self.__event('UPD Att.', filepath, filename)
+        self.kv.journal_planned('attachment', filepath, sha_hash)
+        with self.report.measure(filepath, 'push'):
+            results = self.__with_parent(
+                space, pageid, parentpath,
+                lambda page_id: self.api.attach_file(filepath,
+                                                     name=filename,
+                                                     page_id=page_id,
+                                                     space=space))
         confluence_page_id = results['id'] if 'id' in results else results['results'][0]['id']
         self.kv.save(filepath, {'id': confluence_page_id,
-                                'title': filename, 'sha256': None})
+                                'title': filename, 'sha256': sha_hash,
+                                'stat': self.stats.get(filepath),
+                                'parent': pageid})
+        self.kv.journal_done('attachment', filepath, sha_hash)
         return confluence_page_id
 
-    def __publish_recursive(self, space, parentid, path, root=False):
-        # File: _index.md
-        index_parentid = parentid
-        index_path = path + os.sep + '_index.md'
-        if not root:
-            if os.path.isfile(index_path):
-                # Use local _index.md file
-                index_parentid = self.__update_page(
-                    space, parentid, index_path)
-            else:
-                # Autoindex simulate _index.md in Confluence if missing locally
-                index_parentid = self.__update_page(
-                    space, parentid, index_path, True)
-
-        # Directories: */
-        for f in os.scandir(path):
-            if f.is_dir():
-                self.__publish_recursive(space, index_parentid, f.path)
-
-        # Files: *.* (Except _index.md)
-        for f in os.scandir(path):
-            if f.is_file():
-                if f.path.endswith(".md"):
-                    if not f.path.endswith(os.sep + '_index.md'):
-                        self.__update_page(space, index_parentid, f.path)
-                else:
-                    self.__delete_attachment(f.path)
-                    self.__update_attachment(space, index_parentid, f.path)
+    def __publish_attachment(self, space, pageid, filepath, parentpath):
+        if self.render_only is not None:
+            self.__event('OUT Att.', filepath, os.path.basename(filepath))
+            with self.futures_lock:
+                self.manifest[os.path.relpath(filepath, self.markdown_dir)] = {
+                    'kind': 'attachment',
+                    'title': os.path.basename(filepath),
+                    'parent': pageid,
+                    'sha256': get_file_sha256(filepath)
+                }
+            return None
+
+        metadata = self.kv.load(filepath)
+        sha_hash = self.sources.get(filepath) or get_file_sha256(filepath)
+
+        # Same bytes attached to the same page, nothing to upload
+        if metadata['id'] and metadata['sha256'] == sha_hash \
+           and metadata.get('parent') == pageid and (
+               not self.force_update
+               or self.__completed('attachment', filepath, sha_hash)):
+            self.__event('SKP Att.', filepath, os.path.basename(filepath))
+            return metadata['id']
+
+        # Confluence stores a new version of an attachment with the same name
+        return self.__update_attachment(
+            space, pageid, filepath, parentpath, sha_hash)
+
+    def __publish_node(self, space, node, parentid):
+        if node.kind == 'attachment':
+            self.__publish_attachment(space, parentid, node.path, node.parent)
+            return
+
+        pageid = self.__update_page(space, parentid, node.path,
+                                    node.kind == 'autoindex', node.parent)
+        for child in self.__publish_plan().children.get(node.path, ()):
+            self.__submit(self.__publish_node, space, child, pageid)
+
+    def __remove(self, filepath):
+        metadata = self.kv.load(filepath)
+        self.__event('DEL', filepath, metadata['title'], str(metadata['id']))
+        self.kv.journal_planned('delete', filepath)
+        # Pages linking to or including it render again
+        self.dirty.add(os.path.normpath(filepath))
+        if filepath.endswith(".md"):
+            if metadata['id']:
+                try:
+                    with self.report.measure(filepath, 'delete'):
+                        self.api.remove_page(metadata['id'])
+                except self.api_errors as ex:
+                    # Already removed in Confluence (404) is also removed
+                    if not is_not_found(ex):
+                        log.error('DEL Pag. (Error):%s', status_code(ex),
+                                  extra={'event': 'DEL Pag. (Error)',
+                                         'fields': {
+                                             'id': metadata['id'],
+                                             'status': status_code(ex)}})
+                if self.remote_pages is not None:
+                    self.remote_pages.remove(metadata['id'])
+        else:
+            with self.report.measure(filepath, 'delete'):
+                self.__delete_attachment(filepath)
+
+        self.kv.remove(filepath)
+        self.kv.journal_done('delete', filepath)
+
+    def __run_concurrently(self, fn, items):
+        if self.jobs <= 1:
+            for item in items:
+                fn(item)
+            return
+
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for result in executor.map(fn, items):
+                pass
 
     def delete(self):
-        for filepath in sorted(self.kv.keys()):
+        self.__start_journal()
+        if self.changes is None:
+            # Files (and directory pages) published from markdown_dir today
+            expected = self.__publish_plan().paths()
+            removed = set(os.path.normpath(filepath)
+                          for filepath in self.kv.keys()) - expected
+        else:
+            self.__move_renamed()
+            removed = self.__removed_paths()
+
+        # Group removals by depth, _index.md sorts before its directory
+        removals = {}
+        for filepath in self.kv.keys():
+            path = os.path.normpath(filepath)
+            if self.force_delete or path in removed:
+                depth = path.count(os.sep) * 2
+                if os.path.basename(path) == '_index.md':
+                    depth -= 1
+                removals.setdefault(depth, []).append(filepath)
+
+        # Childs before parents, deepest first, each depth concurrently
+        for depth in sorted(removals, reverse=True):
+            self.__run_concurrently(self.__remove, sorted(removals[depth]))
+
+        self.kv.commit()
+
+    def api_calls(self):
+        if self.api is None:
+            return []
+        return sorted((name, stats['calls'])
+                      for name, stats in self.api.stats().items())
+
+    def run_report(self):
+        return self.report.to_dict(
+            self.api.stats() if self.api is not None else None)
+
+    def __find_dirty(self):
+        # Changed (or new) files, their hashes are reused while publishing
+        states = {}
+        for filepath, stat in self.__publish_plan().files.items():
             metadata = self.kv.load(filepath)
+            if metadata.get('dependencies'):
+                states[filepath] = metadata['dependencies']
+            signature = stat_signature(stat)
+            self.stats[filepath] = signature
+            if filepath.endswith('.md'):
+                stored_hash = metadata.get('source')
+            else:
+                stored_hash = metadata['sha256']
 
-            # Page has Sub-pages (Childs)?
-            index_with_childs = False
-            if filepath.endswith('_index.md'):
-                childs = 0
-                if os.path.isdir(os.path.dirname(filepath)):
-                    for f in os.scandir(os.path.dirname(filepath)):
-                        if f.path.endswith(".md") and \
-                           not f.path.endswith('_index.md'):
-                            childs = childs + 1
-                index_with_childs = childs > 0
-
-            if self.force_delete \
-               or (not os.path.isfile(filepath) and not index_with_childs):
-                print('DEL => Id: '
-                      + metadata['id'] + ', Title: ' + metadata['title'])
-                if filepath.endswith(".md"):
-                    try:
-                        if self.api.get_page_by_id(metadata['id']):
-                            self.api.remove_page(metadata['id'])
-                    except HTTPError as ex:
-                        code = ex.response.status_code
-                        if code != 404:
-                            print("DEL Pag. (Error):" + str(code))
-                        else:
-                            pass
-                else:
-                    self.__delete_attachment(filepath)
+            # Same stat as when last hashed, unchanged without reading it
+            if stored_hash and signature is not None \
+               and metadata.get('stat') == signature and not self.paranoid:
+                self.sources[filepath] = stored_hash
+                continue
 
-                self.kv.remove(filepath)
+            if filepath.endswith('.md'):
+                # Markdown stays buffered to be rendered if changed
+                self.sources[filepath] = self.source_buffer.sha256(filepath)
+            else:
+                with self.report.measure(filepath, 'hash'):
+                    self.sources[filepath] = get_file_sha256(filepath)
+            if stored_hash != self.sources[filepath]:
+                self.dirty.add(os.path.normpath(filepath))
+            else:
+                self.source_buffer.release(filepath)
+                if metadata.get('stat') != signature:
+                    # Touched, not changed: hashed once, not every run
+                    metadata['stat'] = signature
+                    self.kv.save(filepath, metadata)
+
+        # Pages whose dependencies changed since rendered, also outside
+        # the plan (included from outside markdown_dir, removed files)
+        files = set(os.path.normpath(filepath)
+                    for filepath in self.__publish_plan().files)
+        for filepath, dependencies in states.items():
+            for target, (kind, state) in sorted(dependencies.items()):
+                if target in files and target not in self.dirty:
+                    continue
+                if self.__dependency_state(target, kind) != state:
+                    self.dirty.add(os.path.normpath(filepath))
+                    break
+
+        # Pages linking to or including a changed file (transitively)
+        pending = list(self.dirty)
+        while pending:
+            for source in self.kv.dependents(pending.pop()):
+                source = os.path.normpath(source)
+                if source not in self.dirty:
+                    self.dirty.add(source)
+                    pending.append(source)
+
+    def reset(self, changes=None):
+        # Next run (--watch): files read again, warm parser and indexes.
+        # Changes (changed, deleted, renamed) as since a git revision,
+        # None walks the tree. Render only always writes every page.
+        self.changes = changes if self.render_only is None else None
+        self.plan = None
+        self.manifest = {}
+        self.sources = {}
+        self.stats = {}
+        self.dirty = set()
+        self.file_hashes = {}
+        self.journal = None
+        self.futures = []
+        self.report = RunReport(self.markdown_dir)
+        self.source_buffer = SourceBuffer(self.report)
+        if self.api is not None:
+            self.api.reset_stats()
+
+    def render(self):
+        os.makedirs(self.render_only, exist_ok=True)
+        self.__publish(self.__publish_plan().pages())
+
+        manifest_path = os.path.join(self.render_only, 'manifest.json')
+        with open(manifest_path, 'w', encoding='utf-8') as file:
+            json.dump(self.manifest, file, indent=2, sort_keys=True)
+        if self.render_cache is not None:
+            self.render_cache.commit()
 
     def publish(self):
-        self.__publish_recursive(
-            self.space, self.parent_pageid, self.markdown_dir, root=True)
+        if self.render_only is not None:
+            return self.render()
+
+        self.__start_journal()
+        try:
+            self.__find_dirty()
+            self.__publish([
+                filepath for filepath in self.__publish_plan().pages()
+                if self.__needs_render(filepath, self.kv.load(filepath))
+            ])
+            self.kv.journal_done('run', '')
+        finally:
+            self.kv.commit()
+            if self.render_cache is not None:
+                self.render_cache.commit()
+
+        self.__print_orphans()
+
+    def __print_orphans(self):
+        # Pages under the parent page not published from markdown_dir
+        if self.remote_pages is None:
+            return
+
+        known = set(self.kv.load(filepath)['id']
+                    for filepath in self.kv.keys())
+        for page_id in sorted(self.remote_pages.ids()):
+            if page_id not in known:
+                self.__event('ORP', None,
+                             self.remote_pages.get(page_id)['title'], page_id)
+
+    def __publish(self, render_filepaths):
+        render_executor = self.__start_rendering(render_filepaths)
+        try:
+            self.__publish_tree()
+        finally:
+            self.rendering = {}
+            if render_executor is not None:
+                render_executor.shutdown()
+
+    def __publish_tree(self):
+        roots = self.__publish_plan().children.get(None, ())
+        if self.jobs <= 1:
+            for node in roots:
+                self.__publish_node(self.space, node, self.parent_pageid)
+            return
+
+        # Each page is published before submitting its childs in the
+        # plan, so pages are never created before their parent page
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                self.executor = executor
+                try:
+                    for node in roots:
+                        self.__submit(self.__publish_node,
+                                      self.space, node, self.parent_pageid)
+                    while self.futures:
+                        with self.futures_lock:
+                            futures, self.futures = self.futures, []
+                        for future in futures:
+                            future.result()
+                finally:
+                    self.executor = None
+        finally:
+            # Left by a failure, never awaited by a later run (--watch)
+            with self.futures_lock:
+                self.futures = []
@@ -7,11 +7,22 @@ mistune v2 and convert it to Confluence XHTML Storage Format.
 
 import base64
 import json
+import logging
 
 from .HTMLCommentPlugin import render_inline_html_comment, render_block_html_comment
 from mistune import HTMLRenderer
 from urllib.parse import urlparse
 
+log = logging.getLogger(__name__)
+
+TRACE_TOKENS = frozenset((
+    'block_code', 'block_error', 'block_html', 'block_html_comment',
+    'block_quote', 'block_text', 'codespan', 'emphasis', 'heading',
+    'hugo_ref_link', 'image', 'inline_html', 'inline_html_comment',
+    'linebreak', 'link', 'list', 'list_item', 'newline', 'paragraph', 'strong',
+    'text', 'thematic_break',
+))
+
 
 def generate_autoindex():
     return """
@@ -25,9 +36,13 @@ def generate_autoindex():
 
 class ConfluenceRenderer(HTMLRenderer):
 
-    def __init__(self, verbose=False, escape=True,
+    # Increment when the generated Confluence XHTML changes
+    VERSION = 1
+
+    def __init__(self, trace=(), escape=True,
                  allow_harmful_protocols=None):
-        self.verbose = verbose
+        # Token types logged (debug level) while rendering, or 'all'
+        self.trace = TRACE_TOKENS if 'all' in trace else frozenset(trace)
         super(ConfluenceRenderer, self).__init__(
             escape, allow_harmful_protocols)
 
@@ -58,8 +73,8 @@ class ConfluenceRenderer(HTMLRenderer):
         """
 
     def block_code(self, code, info=None):
-        if self.verbose:
-            print(f"block code (lang): {info}")
+        if 'block_code' in self.trace:
+            log.debug('block code (lang): %s', info)
         if info and 'mermaid' in info:
             # Generate Payload for mermaid.ink Request
             payload = json.dumps({
@@ -89,48 +104,48 @@ class ConfluenceRenderer(HTMLRenderer):
             + '</ac:structured-macro>\n'
 
     def block_error(self, html):
-        if self.verbose:
-            print(f"block error: {html}")
+        if 'block_error' in self.trace:
+            log.debug('block error: %s', html)
         return super(ConfluenceRenderer, self).block_error(html)
 
     def block_html(self, html):
-        if self.verbose:
-            print(f"block html: {html}")
+        if 'block_html' in self.trace:
+            log.debug('block html: %s', html)
         return super(ConfluenceRenderer, self).block_html(html)
 
     def block_html_comment(self):
-        if self.verbose:
-            print("block html comment")
+        if 'block_html_comment' in self.trace:
+            log.debug('block html comment')
         return render_block_html_comment()
 
     def block_quote(self, text):
-        if self.verbose:
-            print(f"block quote: {text}")
+        if 'block_quote' in self.trace:
+            log.debug('block quote: %s', text)
         return super(ConfluenceRenderer, self).block_quote(text)
 
     def block_text(self, text):
-        if self.verbose:
-            print(f"block quote: {text}")
+        if 'block_text' in self.trace:
+            log.debug('block text: %s', text)
         return super(ConfluenceRenderer, self).block_text(text)
 
     def codespan(self, text):
-        if self.verbose:
-            print(f"codespan: {text}")
+        if 'codespan' in self.trace:
+            log.debug('codespan: %s', text)
         return super(ConfluenceRenderer, self).codespan(text)
 
     def emphasis(self, text):
-        if self.verbose:
-            print(f"emphasis: {text}")
+        if 'emphasis' in self.trace:
+            log.debug('emphasis: %s', text)
         return super(ConfluenceRenderer, self).emphasis(text)
 
     def heading(self, text, level):
-        if self.verbose:
-            print(f"heading: {level} {text}")
+        if 'heading' in self.trace:
+            log.debug('heading: %s %s', level, text)
         return super(ConfluenceRenderer, self).heading(text, level)
 
     def hugo_ref_link(self, title, text=None):
-        if self.verbose:
-            print("hugo ref link")
+        if 'hugo_ref_link' in self.trace:
+            log.debug('hugo ref link')
         return f"""
         <ac:link>
             <ri:page ri:content-title="{title}" />
@@ -143,8 +158,8 @@ class ConfluenceRenderer(HTMLRenderer):
         """
 
     def image(self, src, alt="", title=None):
-        if self.verbose:
-            print("image")
+        if 'image' in self.trace:
+            log.debug('image')
         is_external = bool(urlparse(src).netloc)
         if is_external:
             # External Image
@@ -158,23 +173,23 @@ class ConfluenceRenderer(HTMLRenderer):
             + '</ac:image>'
 
     def inline_html(self, html):
-        if self.verbose:
-            print(f"inline html: {html}")
+        if 'inline_html' in self.trace:
+            log.debug('inline html: %s', html)
         return super(ConfluenceRenderer, self).inline_html(html)
 
     def inline_html_comment(self, comment):
-        if self.verbose:
-            print(f"inline html comment: {comment}")
+        if 'inline_html_comment' in self.trace:
+            log.debug('inline html comment: %s', comment)
         return render_inline_html_comment(comment)
 
     def linebreak(self):
-        if self.verbose:
-            print("linebreak")
+        if 'linebreak' in self.trace:
+            log.debug('linebreak')
         return super(ConfluenceRenderer, self).linebreak()
 
     def link(self, link, text=None, title=None):
-        if self.verbose:
-            print(f"link: {title} -> {text}")
+        if 'link' in self.trace:
+            log.debug('link: %s -> %s', title, text)
         is_external = bool(urlparse(link).netloc)
         if is_external:
             return '<a href="' + link + '" alt="' \
@@ -192,37 +207,37 @@ class ConfluenceRenderer(HTMLRenderer):
             + '</ac:link>'
 
     def list(self, text, ordered, level, start=None):
-        if self.verbose:
-            print(f"list: {level} {ordered} {text} {start}")
+        if 'list' in self.trace:
+            log.debug('list: %s %s %s %s', level, ordered, text, start)
         return super(ConfluenceRenderer, self).list(text, ordered, level,
                                                     start)
 
     def list_item(self, text, level):
-        if self.verbose:
-            print(f"list_item: {level} {text}")
+        if 'list_item' in self.trace:
+            log.debug('list_item: %s %s', level, text)
         return super(ConfluenceRenderer, self).list_item(text, level)
 
     def newline(self):
-        if self.verbose:
-            print("newline")
+        if 'newline' in self.trace:
+            log.debug('newline')
         return super(ConfluenceRenderer, self).newline()
 
     def paragraph(self, text):
-        if self.verbose:
-            print(f"paragraph: {text}")
+        if 'paragraph' in self.trace:
+            log.debug('paragraph: %s', text)
         return super(ConfluenceRenderer, self).paragraph(text)
 
     def strong(self, text):
-        if self.verbose:
-            print(f"strong: {text}")
+        if 'strong' in self.trace:
+            log.debug('strong: %s', text)
         return super(ConfluenceRenderer, self).strong(text)
 
     def text(self, text):
-        if self.verbose:
-            print(f"text: {text}")
+        if 'text' in self.trace:
+            log.debug('text: %s', text)
         return super(ConfluenceRenderer, self).text(text)
 
     def thematic_break(self):
-        if self.verbose:
-            print("thematic break")
+        if 'thematic_break' in self.trace:
+            log.debug('thematic break')
         return super(ConfluenceRenderer, self).thematic_break()
@@ -2,10 +2,19 @@
 
 Used by ConfluenceRenderer to enable the parsing of all front matter.
 
+FrontMatterIndex keeps the parsed front matter of each file (validated
+by mtime and size) so it is parsed once per run, whether the file is
+rendered or only referenced by Hugo ref links. Files read by the index
+get their newlines normalized as mistune does before parsing.
+
 """
+import os
 import re
+import threading
 import yaml
 
+from .utilities import getFileContent
+
 
 FRONT_MATTER_PATTERN = re.compile((
     r'(?:---\n)'
@@ -13,6 +22,8 @@ FRONT_MATTER_PATTERN = re.compile((
     r'(?:\n---\n)'
 ), flags=re.I)
 
+NEWLINE_PATTERN = re.compile(r'\r\n|\r')
+
 FRONT_MATTER_REQUIRED_FIELDS = [
     'title',
 ]
@@ -32,18 +43,51 @@ class FrontMatterRequireFieldMissingError(Exception):
         self.field = field
 
 
-def parse_front_matter(md, s, state):
+def load_front_matter(s):
     m = FRONT_MATTER_PATTERN.match(s)
 
     if m:
-        # parse front matter
-        front_matter = m.groupdict()['front_matter']
-
         try:
-            front_matter = yaml.load(front_matter, Loader=yaml.SafeLoader)
+            return yaml.load(m.group('front_matter'), Loader=yaml.SafeLoader)
         except yaml.YAMLError as e:
             raise FrontMatterParsingError(e)
 
+    return None
+
+
+class FrontMatterIndex():
+
+    def __init__(self, read=getFileContent):
+        self.read = read
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    def load(self, filepath, content=None):
+        stat = os.stat(filepath)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        key = os.path.normpath(filepath)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != signature:
+                if content is None:
+                    content = NEWLINE_PATTERN.sub('\n', self.read(filepath))
+                entry = (signature, load_front_matter(content))
+                self.entries[key] = entry
+
+        return entry[1]
+
+
+def parse_front_matter(md, s, state, index=None):
+    m = FRONT_MATTER_PATTERN.match(s)
+
+    if m:
+        # parse front matter (once per file if indexed)
+        if index is not None and state.get('__file__'):
+            front_matter = index.load(state['__file__'], s)
+        else:
+            front_matter = load_front_matter(s)
+
         # check for required fields
         for required in FRONT_MATTER_REQUIRED_FIELDS:
             if required not in front_matter.keys():
@@ -61,3 +105,14 @@ def parse_front_matter(md, s, state):
 
 def plugin_front_matter(md):
     md.before_parse_hooks.append(parse_front_matter)
+
+
+class FrontMatterPlugin():
+    def __init__(self, index):
+        self.index = index
+
+    def parse_front_matter(self, md, s, state):
+        return parse_front_matter(md, s, state, self.index)
+
+    def __call__(self, md):
+        md.before_parse_hooks.append(self.parse_front_matter)
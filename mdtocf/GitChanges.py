@@ -0,0 +1,74 @@
+"""Git Changes
+
+Used by ConfluencePublisher (--since) to list the files of markdown_dir
+changed since a git revision, from the local repository only: added and
+modified files (including uncommitted and untracked ones), deleted files
+and renamed files (old path to new path).
+
+Paths are joined to markdown_dir as when walking it, so they match the
+keys stored for each file.
+
+"""
+import os
+import subprocess
+
+
+class GitChangesError(Exception):
+    def __init__(self, command, message):
+        self.command = command
+        self.message = message
+
+    def __str__(self):
+        return '{}: {}'.format(' '.join(self.command), self.message)
+
+
+class GitChanges():
+
+    def __init__(self, markdown_dir, since):
+        self.markdown_dir = markdown_dir
+        self.since = since
+        self.changed = set()
+        self.deleted = set()
+        self.renamed = {}
+        self.__diff()
+
+    def __git(self, *args):
+        command = ['git', '-C', self.markdown_dir] + list(args)
+        try:
+            result = subprocess.run(command, stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE, check=True)
+        except FileNotFoundError as ex:
+            raise GitChangesError(command, str(ex))
+        except subprocess.CalledProcessError as ex:
+            raise GitChangesError(
+                command, ex.stderr.decode('utf-8', 'replace').strip())
+        return [item for item in
+                result.stdout.decode('utf-8').split('\0') if item]
+
+    def __path(self, relpath):
+        # Relative to markdown_dir (--relative), with / separators
+        return os.path.join(self.markdown_dir, *relpath.split('/'))
+
+    def __diff(self):
+        # Revision against the working tree, renames detected
+        self.__git('rev-parse', '--verify', self.since + '^{commit}')
+        items = self.__git('diff', '--name-status', '-z', '-M',
+                           '--relative', '--no-ext-diff',
+                           self.since, '--')
+        while items:
+            status = items.pop(0)
+            if status[0] in 'RC':
+                old, new = self.__path(items.pop(0)), \
+                    self.__path(items.pop(0))
+                if status[0] == 'R':
+                    self.renamed[old] = new
+                self.changed.add(new)
+            elif status[0] == 'D':
+                self.deleted.add(self.__path(items.pop(0)))
+            else:
+                self.changed.add(self.__path(items.pop(0)))
+
+        # New files not added to the repository yet
+        for relpath in self.__git('ls-files', '--others',
+                                  '--exclude-standard', '-z'):
+            self.changed.add(self.__path(relpath))
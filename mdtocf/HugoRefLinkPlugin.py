@@ -1,8 +1,9 @@
+import logging
 import os
-import yaml
 
-from .utilities import getFileContent
-from .FrontMatterPlugin import FRONT_MATTER_PATTERN
+from .FrontMatterPlugin import FrontMatterIndex
+
+log = logging.getLogger(__name__)
 
 REF_LINK_PATTERN = (
     r"(?:[^!]|^)\["
@@ -25,22 +26,22 @@ class HugoRefLinkTargetNotFoundError(Exception):
         self.target = target
 
 
-def get_front_matter_title(filepath):
-    content = getFileContent(filepath)
+def get_front_matter_title(filepath, index=None):
+    if index is None:
+        index = FrontMatterIndex()
 
-    m = FRONT_MATTER_PATTERN.match(content)
-    if m:
-        front_matter = yaml.load(m.group(1), Loader=yaml.SafeLoader)
-        if 'title' in front_matter.keys():
-            return front_matter['title']
+    front_matter = index.load(filepath)
+    if front_matter and 'title' in front_matter.keys():
+        return front_matter['title']
 
     # default to filepath of target if no title found
     raise HugoRefLinkTargetTitleNotFoundError(filepath)
 
 
 class HugoRefLinkPlugin():
-    def __init__(self, markdown_dir):
+    def __init__(self, markdown_dir, front_matter_index=None):
         self.markdown_dir = markdown_dir
+        self.front_matter_index = front_matter_index or FrontMatterIndex()
 
     # some method that receives the matches and state with __file__ info
     def parse_hugo_ref_link(self, inline, m, state):
@@ -62,17 +63,26 @@ class HugoRefLinkPlugin():
             if os.path.isdir(destination):
                 # check for _index.md
                 index_md = os.path.join(destination, '_index.md')
+                target = index_md
                 if os.path.exists(index_md):
-                    title = get_front_matter_title(index_md)
+                    title = get_front_matter_title(
+                        index_md, self.front_matter_index)
                 else:
                     # auto index
                     title = os.path.basename(destination).title()
             else:
                 # link to *.md
-                title = get_front_matter_title(destination)
+                target = destination
+                title = get_front_matter_title(
+                    destination, self.front_matter_index)
+
+            # track the target title dependency of the source page
+            if 'dependencies' in state:
+                state['dependencies'].setdefault(
+                    os.path.normpath(target), 'ref')
         else:
             # link to page that doesn't exist
-            print(os.getcwd())
+            log.debug('Working directory: %s', os.getcwd())
             raise HugoRefLinkTargetNotFoundError(source, destination)
 
         return 'hugo_ref_link', title, text
@@ -0,0 +1,39 @@
+"""Mistune v2 Directive for Including Files
+
+Used by ConfluencePublisher instead of mistune's DirectiveInclude to
+record each included file in state['dependencies'] (as 'include'), also
+for the files included by an included markdown file.
+
+"""
+import os
+
+from mistune.directives import DirectiveInclude
+from mistune.markdown import preprocess
+
+
+class Include(DirectiveInclude):
+    def parse(self, block, m, state):
+        source_file = state.get('__file__')
+        dependencies = state.get('dependencies')
+        if not source_file or dependencies is None:
+            return super(Include, self).parse(block, m, state)
+
+        relpath = m.group('value')
+        options = self.parse_options(m)
+
+        dest = os.path.join(os.path.dirname(source_file), relpath)
+        dest = os.path.normpath(dest)
+        dependencies[dest] = 'include'
+
+        ext = os.path.splitext(relpath)[1]
+        if options or ext not in {'.md', '.markdown', '.mkd'} \
+           or dest == source_file or not os.path.isfile(dest):
+            return super(Include, self).parse(block, m, state)
+
+        with open(dest, 'rb') as f:
+            text = f.read().decode('utf-8')
+
+        # Same as DirectiveInclude, but sharing the dependencies set
+        text, included_state = preprocess(
+            text, {'__file__': dest, 'dependencies': dependencies})
+        return block.parse(text, included_state)
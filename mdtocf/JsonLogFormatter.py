@@ -0,0 +1,30 @@
+"""JSON Log Formatter
+
+Used by mdtocf.py (--log-format json) to write each log record as one
+JSON object per line: the events of ConfluencePublisher (UPD, SKP,
+DEL...) with their fields (title, path, id) and any other record with
+its message.
+
+"""
+import datetime
+import json
+import logging
+
+
+class JsonLogFormatter(logging.Formatter):
+
+    def format(self, record):
+        data = {
+            'time': datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        event = getattr(record, 'event', None)
+        if event is not None:
+            data['event'] = event
+            data.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data)
@@ -1,33 +1,150 @@
 """Key-Value Store Used for Caching
 
 Used by ConfluencePublisher to save metadata related to the processing
-of each markdown file, like: Confluence Page ID, Confluence Page Title
-and XHTML Confluence Content SHA256.
+of each markdown file, like: Confluence Page ID, Confluence Page Title,
+XHTML Confluence Content SHA256 and the file stat (mtime, size, inode)
+when it was last hashed.
+
+Stored in a SQLite database (WAL mode) with one row per file, writes are
+committed in batches. Also stores which files each page depends on
+(Hugo ref link targets and included files), indexed by target. A
+pickleDB (JSON) database found in the same path is imported on first use
+and kept as a backup.
+
+The journal of the last run (page updates, attachment uploads and
+deletions) is stored in the same database: each operation is committed
+as planned before it starts and as done with its metadata, so an
+interrupted run can be resumed.
 
 """
 import json
-import pickledb
+import os
+import sqlite3
+import threading
+
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+
+def load_pickledb(db_path):
+    if not os.path.isfile(db_path) or os.path.getsize(db_path) == 0:
+        return None
+
+    with open(db_path, 'rb') as file:
+        if file.read(len(SQLITE_HEADER)) == SQLITE_HEADER:
+            return None
+
+    with open(db_path, 'r', encoding='utf-8') as file:
+        values = json.load(file)
+
+    os.replace(db_path, db_path + '.pickledb')
+    return values
 
 
 class KeyValue():
 
-    def __init__(self, db_path):
-        self.db = pickledb.load(db_path, False)
+    def __init__(self, db_path, batch_size=100):
+        values = load_pickledb(db_path)
+
+        self.batch_size = batch_size
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS kv ('
+                        'key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS dependencies ('
+                        'target TEXT NOT NULL, source TEXT NOT NULL, '
+                        'PRIMARY KEY (target, source))')
+        self.db.execute('CREATE TABLE IF NOT EXISTS journal ('
+                        'operation TEXT NOT NULL, key TEXT NOT NULL, '
+                        'sha256 TEXT, state TEXT NOT NULL, '
+                        'PRIMARY KEY (operation, key))')
+
+        if values:
+            self.db.executemany('INSERT OR REPLACE INTO kv VALUES (?, ?)',
+                                values.items())
+        self.db.commit()
 
     def keys(self):
-        return [*self.db.getall()]
+        with self.lock:
+            return [key for key, in self.db.execute('SELECT key FROM kv')]
 
     def load(self, key):
-        value = self.db.get(key)
-        if value is False:
-            return {'id': None, 'title': '', 'sha256': ''}
+        with self.lock:
+            row = self.db.execute('SELECT value FROM kv WHERE key = ?',
+                                  (key,)).fetchone()
+        if row is None:
+            return {'id': None, 'title': '', 'sha256': '', 'version': None}
         else:
-            return json.loads(value)
+            return json.loads(row[0])
 
     def save(self, key, value):
-        self.db.set(key, json.dumps(value))
-        self.db.dump()
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO kv VALUES (?, ?)',
+                            (key, json.dumps(value)))
+            self.__written()
 
     def remove(self, key):
-        self.db.rem(key)
-        self.db.dump()
+        with self.lock:
+            self.db.execute('DELETE FROM kv WHERE key = ?', (key,))
+            self.db.execute('DELETE FROM dependencies WHERE source = ?',
+                            (key,))
+            self.__written()
+
+    def dependents(self, target):
+        with self.lock:
+            return [source for source, in self.db.execute(
+                'SELECT source FROM dependencies WHERE target = ?',
+                (target,))]
+
+    def save_dependencies(self, source, targets):
+        with self.lock:
+            self.db.execute('DELETE FROM dependencies WHERE source = ?',
+                            (source,))
+            self.db.executemany('INSERT OR IGNORE INTO dependencies '
+                                'VALUES (?, ?)',
+                                [(target, source) for target in targets])
+            self.__written()
+
+    def journal(self):
+        with self.lock:
+            return {(operation, key): (sha256, state)
+                    for operation, key, sha256, state in self.db.execute(
+                        'SELECT operation, key, sha256, state FROM journal')}
+
+    def clear_journal(self):
+        with self.lock:
+            self.db.execute('DELETE FROM journal')
+            self.db.commit()
+            self.pending = 0
+
+    def journal_planned(self, operation, key, sha256=None):
+        self.__journal(operation, key, sha256, 'planned')
+
+    def journal_done(self, operation, key, sha256=None):
+        self.__journal(operation, key, sha256, 'done')
+
+    def __journal(self, operation, key, sha256, state):
+        # Committed at once, with the writes of the operation if done
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO journal '
+                            'VALUES (?, ?, ?, ?)',
+                            (operation, key, sha256, state))
+            self.db.commit()
+            self.pending = 0
+
+    def commit(self):
+        with self.lock:
+            self.db.commit()
+            self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+    def __written(self):
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.db.commit()
+            self.pending = 0
@@ -0,0 +1,64 @@
+"""Markdown to Confluence XHTML Rendering
+
+Used by ConfluencePublisher to build the mistune v2 pipeline (plugins
+and ConfluenceRenderer) and render a page, either in the publishing
+process or in render worker processes (forked workers inherit the
+pipeline of the publishing process).
+
+"""
+import time
+
+import mistune
+
+from .AdmonitionsDirective import Admonition
+from .IncludeDirective import Include
+from .HTMLCommentPlugin import plugin_html_comment
+from .HugoRefLinkPlugin import HugoRefLinkPlugin
+from .FrontMatterPlugin import FrontMatterIndex, FrontMatterPlugin
+from .ConfluenceRenderer import ConfluenceRenderer
+
+worker_renderer = None
+
+
+def create_renderer(markdown_dir, front_matter_index, trace=()):
+    return mistune.create_markdown(
+        renderer=ConfluenceRenderer(trace),
+        plugins=[
+            FrontMatterPlugin(front_matter_index),
+            Include(),
+            HugoRefLinkPlugin(markdown_dir, front_matter_index),
+            'strikethrough',
+            'footnotes',
+            'table',
+            'url',
+            Admonition(),
+            plugin_html_comment,
+        ]
+    )
+
+
+def render_markdown(renderer, filepath, text):
+    state = {'front_matter': {}, 'dependencies': {}, '__file__': filepath}
+    body = renderer.parse(text, state)
+    return state['front_matter']['title'], body, state['dependencies']
+
+
+def share_renderer(renderer):
+    # Workers forked afterwards inherit the pipeline (compiled scanners
+    # and front matter already loaded) instead of building their own
+    global worker_renderer
+    worker_renderer = renderer
+
+
+def init_render_worker(markdown_dir, trace=()):
+    global worker_renderer
+    if worker_renderer is None:
+        worker_renderer = create_renderer(
+            markdown_dir, FrontMatterIndex(), trace)
+
+
+def render_markdown_worker(filepath, text):
+    # Also the seconds spent rendering, for the run report
+    start = time.perf_counter()
+    result = render_markdown(worker_renderer, filepath, text)
+    return result + (time.perf_counter() - start,)
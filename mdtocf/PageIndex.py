@@ -0,0 +1,49 @@
+"""Confluence Page Index
+
+Used by ConfluencePublisher to answer page lookups (id, title, version
+and parent page id) from memory instead of one request per page. It is
+filled with all the descendants of the parent page, fetched in a few
+paginated requests, and kept up to date with the publisher writes.
+
+"""
+import threading
+
+
+class PageIndex():
+
+    def __init__(self, pages=()):
+        self.pages = {}
+        self.titles = {}
+        self.lock = threading.Lock()
+        for page in pages:
+            ancestors = page.get('ancestors') or [{}]
+            self.add(page['id'], page['title'],
+                     (page.get('version') or {}).get('number'),
+                     ancestors[-1].get('id'))
+
+    def add(self, page_id, title, version, parent):
+        with self.lock:
+            previous = self.pages.get(page_id)
+            if previous is not None:
+                self.titles.pop(previous['title'], None)
+            self.pages[page_id] = {'id': page_id, 'title': title,
+                                   'version': version, 'parent': parent}
+            self.titles[title] = page_id
+
+    def remove(self, page_id):
+        with self.lock:
+            page = self.pages.pop(page_id, None)
+            if page is not None:
+                self.titles.pop(page['title'], None)
+
+    def get(self, page_id):
+        with self.lock:
+            return self.pages.get(page_id)
+
+    def find(self, title):
+        with self.lock:
+            return self.pages.get(self.titles.get(title))
+
+    def ids(self):
+        with self.lock:
+            return list(self.pages)
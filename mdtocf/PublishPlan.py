@@ -0,0 +1,123 @@
+"""Publish Plan
+
+Used by ConfluencePublisher to walk markdown_dir once (one scandir per
+directory, entries sorted by name) into the nodes to publish: a page per
+markdown file, an autoindex page per directory without _index.md and an
+attachment per other file.
+
+Each node links its parent, the path of the _index.md of its directory
+(None under the root), published before the node. Both publishing and
+deleting execute the same plan, in the same order on every run.
+
+Given paths (--since), the plan only holds those files and the index
+pages of their directories, without walking markdown_dir.
+
+"""
+import collections
+import os
+
+PlanNode = collections.namedtuple(
+    'PlanNode', ['path', 'kind', 'parent', 'stat'])
+
+
+class PublishPlan():
+
+    def __init__(self, markdown_dir, paths=None):
+        self.markdown_dir = markdown_dir
+        self.nodes = []
+        self.children = collections.defaultdict(list)
+        self.by_path = {}
+        self.files = {}
+        self.indexes = {}
+        if paths is None:
+            self.__walk()
+        else:
+            self.__walk_paths(paths)
+
+    def __add(self, path, kind, parent, stat=None):
+        node = PlanNode(path, kind, parent, stat)
+        self.nodes.append(node)
+        self.children[parent].append(node)
+        self.by_path[path] = node
+        return node
+
+    def __walk(self):
+        # Depth first, parents before childs, directories as a stack
+        pending = [(self.markdown_dir, None, True)]
+        while pending:
+            path, parent, root = pending.pop()
+            with os.scandir(path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+
+            files = [entry for entry in entries if entry.is_file()]
+            dirs = [entry for entry in entries if entry.is_dir()]
+            for entry in files:
+                self.files[entry.path] = entry.stat()
+
+            # File: _index.md (the root one is not published)
+            index_parent = parent
+            if not root:
+                index_parent = os.path.join(path, '_index.md')
+                if index_parent in self.files:
+                    self.__add(index_parent, 'page', parent,
+                               self.files[index_parent])
+                else:
+                    # Autoindex simulate _index.md in Confluence
+                    self.__add(index_parent, 'autoindex', parent)
+
+            # Files: *.* (Except _index.md)
+            for entry in files:
+                if entry.name == '_index.md':
+                    continue
+                kind = 'page' if entry.name.endswith('.md') else 'attachment'
+                self.__add(entry.path, kind, index_parent,
+                           self.files[entry.path])
+
+            # Directories: */
+            for entry in reversed(dirs):
+                pending.append((entry.path, index_parent, False))
+
+    def __index(self, directory):
+        # Index page of a directory, after those of its parents
+        if directory in self.indexes:
+            return self.indexes[directory]
+        if os.path.normpath(directory) == \
+           os.path.normpath(self.markdown_dir):
+            return None
+
+        parent = self.__index(os.path.dirname(directory))
+        path = os.path.join(directory, '_index.md')
+        if os.path.isfile(path):
+            self.files[path] = os.stat(path)
+            self.__add(path, 'page', parent, self.files[path])
+        else:
+            self.__add(path, 'autoindex', parent)
+        self.indexes[directory] = path
+        return path
+
+    def __walk_paths(self, paths):
+        for path in sorted(paths):
+            directory = os.path.dirname(path)
+            if os.path.basename(path) == '_index.md':
+                # Removed from an existing directory: autoindex page
+                if os.path.isdir(directory):
+                    self.__index(directory)
+                continue
+            if not os.path.isfile(path):
+                continue
+
+            parent = self.__index(directory)
+            if path in self.files:
+                continue
+            self.files[path] = os.stat(path)
+            kind = 'page' if path.endswith('.md') else 'attachment'
+            self.__add(path, kind, parent, self.files[path])
+
+    def pages(self):
+        return [node.path for node in self.nodes if node.kind == 'page']
+
+    def paths(self):
+        # Every path published or found, normalized
+        paths = set(os.path.normpath(node.path) for node in self.nodes)
+        paths.update(os.path.normpath(path) for path in self.files)
+        return paths
@@ -0,0 +1,105 @@
+"""Render Cache
+
+Used by ConfluencePublisher to keep the rendered storage XHTML of pages
+between runs, so a page is only rendered again when its output could
+change. The key (built by the publisher) covers the source hash, the
+title of each Hugo ref link target, the hash of each included file, the
+page title prefix and the ConfluenceRenderer version.
+
+Stored in a SQLite database (WAL mode) with the last dependencies of
+each source, to build its key before rendering. Least recently used
+renders are evicted beyond max_bytes (of XHTML).
+
+"""
+import json
+import sqlite3
+import threading
+import time
+
+
+class RenderCache():
+
+    def __init__(self, db_path, max_bytes=256 * 1024 * 1024, batch_size=100):
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS renders ('
+                        'key TEXT PRIMARY KEY, title TEXT NOT NULL, '
+                        'body TEXT NOT NULL, dependencies TEXT NOT NULL, '
+                        'size INTEGER NOT NULL, used REAL NOT NULL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS renders_used '
+                        'ON renders (used)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS sources ('
+                        'path TEXT PRIMARY KEY, dependencies TEXT NOT NULL)')
+        self.db.commit()
+
+    def dependencies(self, path):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT dependencies FROM sources WHERE path = ?',
+                (path,)).fetchone()
+        return json.loads(row[0]) if row is not None else {}
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT title, body, dependencies FROM renders '
+                'WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.db.execute('UPDATE renders SET used = ? WHERE key = ?',
+                            (time.time(), key))
+            self.__written()
+        return row[0], row[1], json.loads(row[2])
+
+    def put(self, key, path, title, body, dependencies):
+        dependencies = json.dumps(dependencies, sort_keys=True)
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO renders VALUES (?, ?, ?, ?, ?, ?)',
+                (key, title, body, dependencies, len(body), time.time()))
+            self.db.execute('INSERT OR REPLACE INTO sources VALUES (?, ?)',
+                            (path, dependencies))
+            self.__written()
+
+    def evict(self):
+        # Least recently used first, down to 90% of max_bytes
+        with self.lock:
+            size = self.db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM renders').fetchone()[0]
+            if size <= self.max_bytes:
+                return 0
+
+            evicted = 0
+            target = self.max_bytes * 0.9
+            rows = self.db.execute(
+                'SELECT key, size FROM renders ORDER BY used').fetchall()
+            for key, row_size in rows:
+                if size <= target:
+                    break
+                self.db.execute('DELETE FROM renders WHERE key = ?', (key,))
+                size -= row_size
+                evicted += 1
+            self.db.commit()
+            self.pending = 0
+            return evicted
+
+    def commit(self):
+        self.evict()
+        with self.lock:
+            self.db.commit()
+            self.pending = 0
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+    def __written(self):
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.db.commit()
+            self.pending = 0
@@ -0,0 +1,83 @@
+"""Run Report
+
+Used by ConfluencePublisher to time each page and attachment by phase
+(read, hash, render, push, write, delete) and summarize a run, with the
+requests of ConfluenceClient by endpoint (calls, retries, latency and
+bytes uploaded), as JSON or as a table.
+
+"""
+import collections
+import contextlib
+import os
+import threading
+import time
+
+PHASES = ('read', 'hash', 'render', 'push', 'write', 'delete')
+
+
+class RunReport():
+
+    def __init__(self, markdown_dir):
+        self.markdown_dir = markdown_dir
+        self.pages = collections.defaultdict(dict)
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+
+    def add(self, filepath, phase, seconds):
+        key = os.path.relpath(filepath, self.markdown_dir)
+        with self.lock:
+            phases = self.pages[key]
+            phases[phase] = phases.get(phase, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def measure(self, filepath, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(filepath, phase, time.perf_counter() - start)
+
+    def to_dict(self, api=None):
+        with self.lock:
+            pages = {path: dict(phases)
+                     for path, phases in self.pages.items()}
+
+        phases = collections.OrderedDict((phase, 0.0) for phase in PHASES)
+        for page in pages.values():
+            for phase, seconds in page.items():
+                phases[phase] = phases.get(phase, 0.0) + seconds
+
+        api = api or {}
+        return {
+            'seconds': time.perf_counter() - self.start,
+            'phases': phases,
+            'requests': sum(stats['calls'] for stats in api.values()),
+            'retries': sum(stats['retries'] for stats in api.values()),
+            'api': api,
+            'pages': pages
+        }
+
+
+def print_report(report, top=10):
+    print('RUN => Seconds: {:.3f}, Files: {}, Requests: {}, Retries: {}'
+          .format(report['seconds'], len(report['pages']),
+                  report['requests'], report['retries']))
+
+    for phase, seconds in report['phases'].items():
+        if seconds:
+            print('PHS => {:<8} {:>10.3f} s'.format(phase, seconds))
+
+    slowest = sorted(report['pages'].items(),
+                     key=lambda item: sum(item[1].values()),
+                     reverse=True)[:top]
+    for path, phases in slowest:
+        print('TOP => {:>10.3f} s  {}  ({})'.format(
+            sum(phases.values()), path,
+            ', '.join('{} {:.3f}'.format(phase, seconds)
+                      for phase, seconds in phases.items())))
+
+    for endpoint, stats in sorted(report['api'].items()):
+        print('API => {:>6} calls {:>4} retries {:>10.3f} s {:>8.1f} ms max'
+              ' {:>10} bytes  {}'.format(
+                  stats['calls'], stats['retries'], stats['seconds'],
+                  stats['max_seconds'] * 1000, stats['bytes'], endpoint))
@@ -0,0 +1,57 @@
+"""Markdown Source Buffer
+
+Used by ConfluencePublisher to read each markdown file once per run: the
+same bytes are hashed for change detection, then decoded as UTF-8 and
+handed to the front matter index and the mistune renderer.
+
+"""
+import hashlib
+import os
+import threading
+import time
+
+
+class SourceBuffer():
+
+    def __init__(self, report=None):
+        self.report = report
+        self.contents = {}
+        self.hashes = {}
+        self.lock = threading.Lock()
+
+    def __load(self, filepath, keep):
+        start = time.perf_counter()
+        with open(filepath, 'rb') as file:
+            content = file.read()
+        read = time.perf_counter()
+
+        key = os.path.normpath(filepath)
+        text = content.decode('utf-8')
+        sha_hash = hashlib.sha256(content).hexdigest()
+        if self.report is not None:
+            self.report.add(filepath, 'read', read - start)
+            self.report.add(filepath, 'hash', time.perf_counter() - read)
+        with self.lock:
+            self.hashes[key] = sha_hash
+            if keep:
+                self.contents[key] = text
+        return text
+
+    def sha256(self, filepath):
+        key = os.path.normpath(filepath)
+        with self.lock:
+            if key in self.hashes:
+                return self.hashes[key]
+        self.__load(filepath, keep=True)
+        return self.hashes[key]
+
+    def read(self, filepath, keep=True):
+        key = os.path.normpath(filepath)
+        with self.lock:
+            if key in self.contents:
+                return self.contents[key]
+        return self.__load(filepath, keep)
+
+    def release(self, filepath):
+        with self.lock:
+            self.contents.pop(os.path.normpath(filepath), None)
@@ -0,0 +1,242 @@
+"""Watcher
+
+Used by mdtocf.py (--watch) to wait for changes in markdown_dir between
+runs: with inotify on Linux (through libc, no dependency), by polling
+the stat of the tree otherwise (or with --watch-polling). Bursts of
+events, like an editor saving or a git checkout, are gathered until
+nothing changed for the debounce delay.
+
+Changes are returned as the files changed, deleted and renamed (old
+path to new path), or None when directories changed: the next run then
+walks the whole tree.
+
+"""
+import collections
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+Changes = collections.namedtuple(
+    'Changes', ['changed', 'deleted', 'renamed'])
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+IN_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+    IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+INOTIFY_EVENT = struct.Struct('iIII')
+
+
+def load_libc():
+    # None where inotify is not available (not Linux)
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class Watcher():
+
+    def __init__(self, markdown_dir, debounce=0.5, interval=1.0,
+                 polling=False, ignore=()):
+        self.markdown_dir = markdown_dir
+        self.debounce = debounce
+        self.interval = interval
+        self.ignore = [os.path.abspath(path) for path in ignore if path]
+        self.fd = None
+        self.watches = {}
+        self.snapshot = None
+
+        self.libc = None if polling else load_libc()
+        if self.libc is not None:
+            fd = self.libc.inotify_init1(os.O_CLOEXEC)
+            if fd >= 0:
+                self.fd = fd
+                self.__watch_tree(markdown_dir)
+        if self.fd is None:
+            self.snapshot = self.__scan()
+
+    def __ignored(self, path):
+        # Files written by the run itself (database, cache, output)
+        path = os.path.abspath(path)
+        return any(path == ignored or path.startswith(ignored + '-')
+                   or path.startswith(ignored + os.sep)
+                   for ignored in self.ignore)
+
+    def __watch_tree(self, path):
+        pending = [path]
+        while pending and self.fd is not None:
+            directory = pending.pop()
+            if self.__ignored(directory):
+                continue
+            wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(directory), IN_MASK)
+            if wd < 0:
+                if ctypes.get_errno() == errno.ENOSPC:
+                    # Out of inotify watches (fs.inotify.max_user_watches)
+                    self.__start_polling()
+                continue
+            self.watches[wd] = directory
+            try:
+                with os.scandir(directory) as it:
+                    pending.extend(entry.path for entry in it
+                                   if entry.is_dir())
+            except OSError:
+                continue
+
+    def __start_polling(self):
+        os.close(self.fd)
+        self.fd = None
+        self.watches = {}
+        self.snapshot = self.__scan()
+
+    def __read_events(self, timeout):
+        # Events ready within timeout (None waits for the first)
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+
+        data = os.read(self.fd, 65536)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def wait(self):
+        if self.fd is None:
+            return self.__poll()
+
+        paths = set()
+        moved = {}
+        renamed = {}
+        full = False
+        events = self.__read_events(None)
+        while events:
+            for wd, mask, cookie, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    full = True
+                    continue
+                if mask & IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                directory = self.watches.get(wd)
+                if directory is None or self.__ignored(directory):
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    full = True
+                    continue
+
+                path = os.path.join(directory, name)
+                if self.__ignored(path):
+                    continue
+                if mask & IN_ISDIR:
+                    full = True
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        self.__watch_tree(path)
+                    continue
+
+                paths.add(path)
+                if mask & IN_MOVED_FROM:
+                    moved[cookie] = path
+                elif mask & IN_MOVED_TO and cookie in moved:
+                    renamed[moved.pop(cookie)] = path
+            if self.fd is None:
+                # Switched to polling, watches missing
+                return None
+            events = self.__read_events(self.debounce)
+
+        if full:
+            return None
+
+        # As found on disk after the burst (editors save through renames)
+        changed = set(path for path in paths if os.path.isfile(path))
+        renamed = {old: new for old, new in renamed.items()
+                   if new in changed and not os.path.lexists(old)}
+        deleted = set(path for path in paths
+                      if not os.path.lexists(path)) - set(renamed)
+        return Changes(changed, deleted, renamed)
+
+    def __scan(self):
+        # Stat of every file, and every directory
+        files = {}
+        dirs = set()
+        pending = [self.markdown_dir]
+        while pending:
+            directory = pending.pop()
+            dirs.add(directory)
+            try:
+                with os.scandir(directory) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            for entry in entries:
+                if self.__ignored(entry.path):
+                    continue
+                try:
+                    if entry.is_dir():
+                        pending.append(entry.path)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        files[entry.path] = (stat.st_mtime_ns, stat.st_size,
+                                             stat.st_ino)
+                except OSError:
+                    continue
+        return files, dirs
+
+    def __poll(self):
+        while True:
+            time.sleep(self.interval)
+            scan = self.__scan()
+            if scan != self.snapshot:
+                break
+
+        # Until two scans a debounce delay apart find the same tree
+        while True:
+            time.sleep(self.debounce)
+            last, scan = scan, self.__scan()
+            if scan == last:
+                break
+
+        (old_files, old_dirs), (files, dirs) = self.snapshot, scan
+        self.snapshot = scan
+        if dirs != old_dirs:
+            return None
+
+        changed = set(path for path, stat in files.items()
+                      if old_files.get(path) != stat)
+        deleted = set(old_files) - set(files)
+
+        # Same mtime, size and inode under another name: renamed
+        added = dict((files[path], path) for path in changed
+                     if path not in old_files)
+        renamed = {}
+        for path in deleted:
+            if old_files[path] in added:
+                renamed[path] = added[old_files[path]]
+        return Changes(changed, deleted - set(renamed), renamed)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
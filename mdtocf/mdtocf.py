@@ -4,8 +4,17 @@ This script convert markdown pages and publish them to confluence pages
 
 """
 import argparse
+import json
+import logging
 import os
+import sys
 from .ConfluencePublisher import ConfluencePublisher
+from .GitChanges import GitChangesError
+from .JsonLogFormatter import JsonLogFormatter
+from .RunReport import print_report
+from .Watcher import Watcher
+
+log = logging.getLogger('mdtocf')
 
 
 def environ_bool(key, default=False):
@@ -37,7 +46,7 @@ def environ_string(key, default=None):
     return result
 
 
-def environ_or_required(key):
+def environ_or_required(key, required=True):
 
     result = {
         'metavar': key
@@ -48,28 +57,50 @@ def environ_or_required(key):
     elif os.environ.get(f"INPUT_{key}"):
         result['default'] = os.environ.get(f"INPUT_{key}")
     else:
-        result['required'] = True
+        result['required'] = required
 
     return result
 
 
+def configure_logging(verbose=False, trace=(), log_format='text'):
+    handler = logging.StreamHandler(sys.stdout)
+    if log_format == 'json':
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(message)s'))
+    log.addHandler(handler)
+    log.setLevel(logging.DEBUG if verbose or trace else logging.INFO)
+    log.propagate = False
+
+
 def main():
+    # Confluence arguments are not required to render only
+    pre_parser = argparse.ArgumentParser(add_help=False)
+    pre_parser.add_argument('--render-only',
+                            **environ_string('RENDER_ONLY'))
+    confluence_required = pre_parser.parse_known_args()[0].render_only is None
+
     parser = argparse.ArgumentParser()
     parser.add_argument('--confluence-username',
                         help='e.g. "example@example.com"',
-                        **environ_or_required('CONFLUENCE_USERNAME'))
+                        **environ_or_required('CONFLUENCE_USERNAME',
+                                              confluence_required))
     parser.add_argument('--confluence-api-token',
                         help='e.g. "a87D98AfDsf98dsf7AdsNfaa2"',
-                        **environ_or_required('CONFLUENCE_API_TOKEN'))
+                        **environ_or_required('CONFLUENCE_API_TOKEN',
+                                              confluence_required))
     parser.add_argument('--confluence-url',
                         help='e.g. "https://example.jira.com/"',
-                        **environ_or_required('CONFLUENCE_URL'))
+                        **environ_or_required('CONFLUENCE_URL',
+                                              confluence_required))
     parser.add_argument('--confluence-space',
                         help='e.g. ~989819389 (Personal Space), 78712486',
-                        **environ_or_required('CONFLUENCE_SPACE'))
+                        **environ_or_required('CONFLUENCE_SPACE',
+                                              confluence_required))
     parser.add_argument('--confluence-parent-pageid',
                         help='e.g. "Page Information: ?pageId=1650458860',
-                        **environ_or_required('CONFLUENCE_PARENT_PAGEID'))
+                        **environ_or_required('CONFLUENCE_PARENT_PAGEID',
+                                              confluence_required))
     parser.add_argument('--markdown-dir',
                         help='e.g. "../mydocs"',
                         **environ_or_required('MARKDOWN_DIR'))
@@ -84,7 +115,7 @@ def main():
                         action="store_true",
                         help='default=False.' +
                         ' Force page update in Confluence',
-                        **environ_bool('FORCE_UPDATE', default=True))
+                        **environ_bool('FORCE_UPDATE', default=False))
     parser.add_argument('--force-delete',
                         action="store_true",
                         help='default=False. Force page removal' +
@@ -95,31 +126,181 @@ def main():
                         help='default=False. Skip page update' +
                         ' in Confluence',
                         **environ_bool('SKIP_UPDATE', default=False))
+    parser.add_argument('--since',
+                        help='e.g. "HEAD~1". Publish only the files' +
+                        ' changed since this git revision (and the pages' +
+                        ' depending on them)',
+                        **environ_string('SINCE'))
+    parser.add_argument('--resume',
+                        action="store_true",
+                        help='default=False. Continue an interrupted run,' +
+                        ' pages and attachments it published are not' +
+                        ' published again (even with --force-update)',
+                        **environ_bool('RESUME', default=False))
+    parser.add_argument('--watch',
+                        action="store_true",
+                        help='default=False. Stay running and publish' +
+                        ' again the files changed in markdown-dir',
+                        **environ_bool('WATCH', default=False))
+    parser.add_argument('--watch-debounce',
+                        type=float,
+                        help='default=0.5. Seconds without changes' +
+                        ' before publishing',
+                        **environ_string('WATCH_DEBOUNCE', default=0.5))
+    parser.add_argument('--watch-interval',
+                        type=float,
+                        help='default=1. Seconds between scans when' +
+                        ' polling',
+                        **environ_string('WATCH_INTERVAL', default=1.0))
+    parser.add_argument('--watch-polling',
+                        action="store_true",
+                        help='default=False. Poll markdown-dir instead of' +
+                        ' inotify (e.g. network filesystems)',
+                        **environ_bool('WATCH_POLLING', default=False))
+    parser.add_argument('--paranoid',
+                        action="store_true",
+                        help='default=False. Hash every file, even when' +
+                        ' unchanged since the last run (same mtime, size' +
+                        ' and inode)',
+                        **environ_bool('PARANOID', default=False))
+    parser.add_argument('--jobs',
+                        type=int,
+                        help='default=1. Number of pages and attachments' +
+                        ' published concurrently in Confluence',
+                        **environ_string('JOBS', default=1))
+    parser.add_argument('--max-connections',
+                        type=int,
+                        help='default=10. Maximum concurrent requests' +
+                        ' (pooled connections) to Confluence',
+                        **environ_string('MAX_CONNECTIONS', default=10))
+    parser.add_argument('--retries',
+                        type=int,
+                        help='default=5. Retries of throttled (429) or' +
+                        ' failed (5xx) Confluence requests',
+                        **environ_string('RETRIES', default=5))
+    parser.add_argument('--render-jobs',
+                        type=int,
+                        help='default=1. Number of processes rendering' +
+                        ' markdown ahead of publishing',
+                        **environ_string('RENDER_JOBS', default=1))
+    parser.add_argument('--render-only',
+                        help='e.g. "./rendered". Write Confluence XHTML' +
+                        ' and manifest.json to a directory, no Confluence' +
+                        ' API calls',
+                        **environ_string('RENDER_ONLY'))
+    parser.add_argument('--render-cache',
+                        help='e.g. "./render-cache.db". Keep rendered' +
+                        ' pages between runs in this database (disabled' +
+                        ' by default)',
+                        **environ_string('RENDER_CACHE'))
+    parser.add_argument('--render-cache-size',
+                        type=int,
+                        help='default=256. Maximum size (MB) of the' +
+                        ' rendered pages cache',
+                        **environ_string('RENDER_CACHE_SIZE', default=256))
+    parser.add_argument('--report',
+                        help='e.g. "./report.json". Write the run report' +
+                        ' (timings by page and phase, requests by' +
+                        ' endpoint) as JSON',
+                        **environ_string('REPORT'))
     parser.add_argument('--verbose',
                         action="store_true",
                         help='default=False. Show additional output',
                         **environ_bool('VERBOSE', default=False))
+    parser.add_argument('--trace',
+                        help='e.g. "heading,link" or "all". Log the' +
+                        ' markdown tokens of these types while rendering',
+                        **environ_string('TRACE', default=''))
+    parser.add_argument('--log-format',
+                        choices=['text', 'json'],
+                        help='default=text. Output lines, or JSON records' +
+                        ' (one per line)',
+                        **environ_string('LOG_FORMAT', default='text'))
 
     args = parser.parse_args()
+    if args.since and args.force_delete:
+        parser.error('--since cannot be used with --force-delete')
+    trace = tuple(name.strip() for name in args.trace.split(',')
+                  if name.strip())
+    configure_logging(args.verbose, trace, args.log_format)
+
+    try:
+        confluence_publisher = ConfluencePublisher(
+            url=args.confluence_url,
+            username=args.confluence_username,
+            api_token=args.confluence_api_token,
+            page_title_prefix=args.confluence_page_title_prefix,
+            markdown_dir=args.markdown_dir,
+            db_path=args.db_path,
+            space=args.confluence_space,
+            parent_pageid=args.confluence_parent_pageid,
+            force_update=args.force_update,
+            force_delete=args.force_delete,
+            skip_update=args.skip_update,
+            jobs=args.jobs,
+            render_only=args.render_only,
+            render_jobs=args.render_jobs,
+            max_connections=args.max_connections,
+            retries=args.retries,
+            trace=trace,
+            render_cache=args.render_cache,
+            render_cache_size=args.render_cache_size * 1024 * 1024,
+            paranoid=args.paranoid,
+            since=args.since,
+            resume=args.resume
+        )
+    except GitChangesError as ex:
+        sys.exit('--since: {}'.format(ex))
+
+    run(confluence_publisher, args)
+    if args.watch:
+        watch(confluence_publisher, args)
+
+
+def run(confluence_publisher, args):
+    if args.render_only is not None:
+        confluence_publisher.render()
+    else:
+        confluence_publisher.delete()
+        if not args.skip_update:
+            confluence_publisher.publish()
+
+    report = confluence_publisher.run_report()
+    if args.log_format == 'json':
+        log.info('RUN => Seconds: %.3f', report['seconds'], extra={
+            'event': 'RUN',
+            'fields': {key: value for key, value in report.items()
+                       if key != 'pages'}})
+    else:
+        print_report(report)
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+
 
-    confluence_publisher = ConfluencePublisher(
-        url=args.confluence_url,
-        username=args.confluence_username,
-        api_token=args.confluence_api_token,
-        page_title_prefix=args.confluence_page_title_prefix,
-        markdown_dir=args.markdown_dir,
-        db_path=args.db_path,
-        space=args.confluence_space,
-        parent_pageid=args.confluence_parent_pageid,
-        force_update=args.force_update,
-        force_delete=args.force_delete,
-        skip_update=args.skip_update,
-        verbose=args.verbose
-    )
-
-    confluence_publisher.delete()
-    if not args.skip_update:
-        confluence_publisher.publish()
+def watch(confluence_publisher, args):
+    # Same publisher each run: parser, session and indexes stay warm
+    watcher = Watcher(
+        args.markdown_dir, debounce=args.watch_debounce,
+        interval=args.watch_interval, polling=args.watch_polling,
+        ignore=[args.db_path, args.render_cache, args.render_only,
+                args.report])
+    log.info('WCH => Dir: %s (%s)', args.markdown_dir,
+             'polling' if watcher.fd is None else 'inotify')
+    try:
+        while True:
+            changes = watcher.wait()
+            confluence_publisher.reset(changes)
+            try:
+                run(confluence_publisher, args)
+            except Exception as ex:
+                # Fixed by the next save (e.g. missing front matter)
+                log.error('WCH => Error: %r', ex,
+                          exc_info=log.isEnabledFor(logging.DEBUG))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,241 @@
+"""Rendering and Publishing Benchmarks
+
+Generates synthetic trees (see synthetic.py) of several sizes and times:
+
+- render: ConfluenceRenderer and the plugins, one page after the other,
+  from markdown already in memory.
+- render-only: ConfluencePublisher end-to-end with --render-only (walk,
+  hashing, rendering and writing the storage XHTML).
+- publish: ConfluencePublisher end-to-end against a fake Confluence
+  (see fake_confluence.py), into an empty space.
+- publish-noop: the same publish again, nothing changed.
+
+And the cold start of the mdtocf entry point, in new processes, on a one
+page tree: importing it (import), rendering (cold-start) and publishing
+the page after a change (cold-start-publish).
+
+Results are printed as a table and written as JSON (--output), to track
+regressions release to release.
+
+Usage: python -m mdtocf.tests.benchmark --sizes 100,1000 --output bench.json
+
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from mdtocf.ConfluencePublisher import ConfluencePublisher
+from mdtocf.FrontMatterPlugin import FrontMatterIndex
+from mdtocf.MarkdownRenderer import create_renderer, render_markdown
+from mdtocf.tests.fake_confluence import FakeConfluence
+from mdtocf.tests.synthetic import add_tree_arguments, generate_tree, \
+    tree_arguments
+
+
+def get_version():
+    path = os.path.join(os.path.dirname(__file__), '..', '..', 'VERSION')
+    if not os.path.isfile(path):
+        return None
+    with open(path) as file:
+        return file.readline().strip()
+
+
+def markdown_files(path):
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            if name.endswith('.md'):
+                yield os.path.join(root, name)
+
+
+def best_time(fn, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_render(tree_dir, repeat):
+    texts = {}
+    for filepath in markdown_files(tree_dir):
+        with open(filepath, encoding='utf-8') as file:
+            texts[filepath] = file.read()
+    renderer = create_renderer(tree_dir, FrontMatterIndex())
+
+    def run():
+        for filepath, text in texts.items():
+            render_markdown(renderer, filepath, text)
+
+    return len(texts), sum(len(text) for text in texts.values()), \
+        best_time(run, repeat)
+
+
+def bench_render_only(tree_dir, output_dir, repeat, render_jobs):
+    def run():
+        publisher = ConfluencePublisher(
+            None, None, None, '', tree_dir, None, None, None,
+            render_only=output_dir, render_jobs=render_jobs)
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            publisher.render()
+
+    return best_time(run, repeat)
+
+
+def bench_publish(tree_dir, db_path, args):
+    # Cold publish into an empty space, then the same publish again
+    timings = []
+    with FakeConfluence(latency=args.latency) as fake:
+        for run in range(2):
+            start = time.perf_counter()
+            publisher = ConfluencePublisher(
+                fake.url, 'benchmark', 'benchmark', '', tree_dir, db_path,
+                fake.space, fake.root_id, jobs=args.jobs,
+                render_jobs=args.render_jobs)
+            with open(os.devnull, 'w') as devnull, \
+                    contextlib.redirect_stdout(devnull):
+                publisher.delete()
+                publisher.publish()
+            timings.append((time.perf_counter() - start,
+                            sum(count for endpoint, count
+                                in publisher.api_calls())))
+    return timings
+
+
+def run_entry_point(*args):
+    # New interpreter, as a CI job would run mdtocf
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env = dict(os.environ, PYTHONPATH=root)
+    subprocess.run([sys.executable] + list(args), env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def bench_cold_start(workdir, repeat):
+    tree_dir = os.path.join(workdir, 'tree')
+    generate_tree(tree_dir, 1)
+    page = os.path.join(tree_dir, 'page_0.md')
+    timings = {}
+
+    timings['import'] = best_time(
+        lambda: run_entry_point('-c', 'import mdtocf.mdtocf'), repeat)
+    timings['cold-start'] = best_time(
+        lambda: run_entry_point(
+            '-m', 'mdtocf.mdtocf', '--markdown-dir', tree_dir,
+            '--render-only', os.path.join(workdir, 'xhtml')), repeat)
+
+    with FakeConfluence() as fake:
+        def publish():
+            run_entry_point(
+                '-m', 'mdtocf.mdtocf', '--markdown-dir', tree_dir,
+                '--db-path', os.path.join(workdir, 'meta.db'),
+                '--confluence-url', fake.url,
+                '--confluence-username', 'benchmark',
+                '--confluence-api-token', 'benchmark',
+                '--confluence-space', fake.space,
+                '--confluence-parent-pageid', fake.root_id)
+
+        def change_and_publish():
+            with open(page, 'a', encoding='utf-8') as file:
+                file.write('\nChanged.\n')
+            publish()
+
+        publish()
+        timings['cold-start-publish'] = best_time(change_and_publish, repeat)
+
+    return timings
+
+
+def result(name, size, pages, seconds, **extra):
+    record = {'name': name, 'size': size, 'pages': pages,
+              'seconds': round(seconds, 6),
+              'pages_per_second': round(pages / seconds, 2) if seconds
+              else None}
+    record.update(extra)
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='100,1000,5000,20000',
+                        help='default=100,1000,5000,20000. Pages per tree')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='default=1. Runs per benchmark (best is kept)')
+    parser.add_argument('--render-jobs', type=int, default=1,
+                        help='default=1. Render processes of render-only')
+    parser.add_argument('--jobs', type=int, default=4,
+                        help='default=4. Publisher threads of publish')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='default=0. Seconds per fake Confluence request')
+    parser.add_argument('--no-publish', dest='publish', action='store_false',
+                        help='Skip the publish benchmarks')
+    parser.add_argument('--output', default=None,
+                        help='e.g. "bench.json" (JSON results)')
+    add_tree_arguments(parser)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, seconds in bench_cold_start(workdir, args.repeat).items():
+            results.append(result(name, 1, 1, seconds))
+
+    for size in [int(size) for size in args.sizes.split(',')]:
+        with tempfile.TemporaryDirectory() as workdir:
+            tree_dir = os.path.join(workdir, 'tree')
+            generate_tree(tree_dir, size, **tree_arguments(args))
+
+            pages, chars, seconds = bench_render(tree_dir, args.repeat)
+            results.append(result('render', size, pages, seconds,
+                                  chars=chars))
+
+            seconds = bench_render_only(
+                tree_dir, os.path.join(workdir, 'xhtml'), args.repeat,
+                args.render_jobs)
+            results.append(result('render-only', size, pages, seconds,
+                                  render_jobs=args.render_jobs))
+
+            if args.publish:
+                (seconds, calls), (noop_seconds, noop_calls) = \
+                    bench_publish(tree_dir,
+                                  os.path.join(workdir, 'meta.db'), args)
+                results.append(result('publish', size, pages, seconds,
+                                      api_calls=calls, jobs=args.jobs,
+                                      latency=args.latency))
+                results.append(result('publish-noop', size, pages,
+                                      noop_seconds, api_calls=noop_calls,
+                                      jobs=args.jobs, latency=args.latency))
+
+    for record in results:
+        print('{:<18} {:>7} pages {:>10.3f} s {:>10} pages/s {:>7} calls'
+              .format(record['name'], record['pages'], record['seconds'],
+                      record['pages_per_second'],
+                      record.get('api_calls', '-')))
+
+    report = {
+        'version': get_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'timestamp': datetime.datetime.now(
+            datetime.timezone.utc).isoformat(),
+        'arguments': vars(args),
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+"""Fake Confluence Server
+
+In-process stand-in for the subset of the Confluence REST API used by
+ConfluencePublisher (through atlassian-python-api and ConfluenceClient):
+pages (search by title, get, create, update, remove, history, children
+and descendants) and attachments (list, upload, new version, remove).
+
+Served over HTTP (keep-alive) from a thread, so the real client code is
+exercised, with configurable latency per request, injected server errors
+(500/502/503) and throttling (429 with Retry-After). Random failures are
+seeded, so the same run fails the same way.
+
+Usage: python -m mdtocf.tests.fake_confluence --port 8090 --latency 0.05
+
+"""
+import argparse
+import collections
+import email.parser
+import email.policy
+import itertools
+import json
+import random
+import re
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+ROUTES = (
+    ('content', re.compile(r'^/rest/api/content/?$')),
+    ('page', re.compile(r'^/rest/api/content/(?P<id>\w+)$')),
+    ('history', re.compile(r'^/rest/api/content/(?P<id>\w+)/history$')),
+    ('descendants',
+     re.compile(r'^/rest/api/content/(?P<id>\w+)/descendant/page$')),
+    ('children', re.compile(r'^/rest/api/content/(?P<id>\w+)/child/page$')),
+    ('attachments',
+     re.compile(r'^/rest/api/content/(?P<id>\w+)/child/attachment$')),
+    ('attachment', re.compile(
+        r'^/rest/api/content/(?P<id>\w+)'
+        r'/child/attachment/(?P<att>\w+)/data$')),
+)
+
+
+class FakeConfluenceError(Exception):
+    def __init__(self, status, message, headers=None):
+        self.status = status
+        self.message = message
+        self.headers = headers or {}
+
+
+class FakeConfluenceHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body sent at once, small writes not delayed
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.__handle('GET')
+
+    def do_POST(self):
+        self.__handle('POST')
+
+    def do_PUT(self):
+        self.__handle('PUT')
+
+    def do_DELETE(self):
+        self.__handle('DELETE')
+
+    def __handle(self, method):
+        url = urlsplit(self.path)
+        params = {key: values[-1]
+                  for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        status, headers, data = self.server.fake.handle(
+            method, url.path, params, self.headers.get('Content-Type', ''),
+            body)
+
+        content = b'' if data is None else json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class FakeConfluence():
+
+    def __init__(self, space='TEST', latency=0.0, error_rate=0.0,
+                 throttle_rate=0.0, retry_after=1, seed=0, port=0):
+        self.space = space
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.port = port
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.pages = {}
+        self.titles = {}
+        self.childs = collections.defaultdict(dict)
+        self.attachments = {}
+        self.calls = collections.Counter()
+        self.errors = collections.Counter()
+        self.server = None
+        self.thread = None
+        self.root_id = self.create_page('Root', '', None)['id']
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+
+    def start(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', self.port),
+                                          FakeConfluenceHandler)
+        self.server.daemon_threads = True
+        self.server.fake = self
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # Pages
+
+    def create_page(self, title, body, parent):
+        page = {'id': str(next(self.ids)), 'title': title, 'body': body,
+                'parent': parent, 'version': 1}
+        self.pages[page['id']] = page
+        self.titles[title] = page['id']
+        self.childs[parent][page['id']] = None
+        return page
+
+    def find_page(self, title):
+        return self.pages.get(self.titles.get(title))
+
+    def rename_page(self, page, title):
+        del self.titles[page['title']]
+        self.titles[title] = page['id']
+        page['title'] = title
+
+    def move_page(self, page, parent):
+        del self.childs[page['parent']][page['id']]
+        self.childs[parent][page['id']] = None
+        page['parent'] = parent
+
+    def delete_page(self, page):
+        # Confluence moves the childs of a removed page to its parent
+        for child in self.children(page['id']):
+            self.move_page(child, page['parent'])
+        del self.childs[page['parent']][page['id']]
+        del self.titles[page['title']]
+        del self.pages[page['id']]
+
+    def ancestors(self, page):
+        ancestors = []
+        parent = page['parent']
+        while parent is not None:
+            ancestors.insert(0, {'id': parent, 'type': 'page',
+                                 'title': self.pages[parent]['title']})
+            parent = self.pages[parent]['parent']
+        return ancestors
+
+    def children(self, page_id):
+        return [self.pages[child] for child in self.childs.get(page_id, ())]
+
+    def descendants(self, page_id):
+        pending = [page_id]
+        while pending:
+            for page in self.children(pending.pop(0)):
+                yield page
+                pending.append(page['id'])
+
+    def page_json(self, page, expand=''):
+        data = {
+            'id': page['id'],
+            'type': 'page',
+            'status': 'current',
+            'title': page['title'],
+            'space': {'key': self.space},
+            'version': {'number': page['version']},
+            'ancestors': self.ancestors(page),
+            '_links': {'webui': '/pages/{}'.format(page['id']),
+                       'tinyui': '/x/{}'.format(page['id'])}
+        }
+        if 'body.storage' in expand:
+            data['body'] = {'storage': {'value': page['body'],
+                                        'representation': 'storage'}}
+        return data
+
+    def attachment_json(self, attachment):
+        return {'id': attachment['id'], 'type': 'attachment',
+                'title': attachment['title'],
+                'version': {'number': attachment['version']},
+                'extensions': {'fileSize': attachment['size']}}
+
+    def get_page(self, page_id):
+        page = self.pages.get(page_id)
+        if page is None:
+            raise FakeConfluenceError(404, 'No content with id ' + page_id)
+        return page
+
+    def results(self, items, params):
+        start = int(params.get('start', 0))
+        limit = int(params.get('limit', 25))
+        results = items[start:start + limit]
+        data = {'results': results, 'start': start, 'limit': limit,
+                'size': len(results), '_links': {}}
+        if start + limit < len(items):
+            data['_links']['next'] = 'start={}'.format(start + limit)
+        return data
+
+    # Requests
+
+    def __fail(self):
+        # Injected failures, decided before touching any state
+        if self.random.random() < self.throttle_rate:
+            raise FakeConfluenceError(
+                429, 'Rate limited',
+                {'Retry-After': str(self.retry_after)})
+        if self.random.random() < self.error_rate:
+            raise FakeConfluenceError(
+                self.random.choice((500, 502, 503)), 'Injected error')
+
+    def handle(self, method, path, params, content_type, body):
+        if self.latency:
+            time.sleep(self.latency)
+
+        route, match = None, None
+        for name, pattern in ROUTES:
+            match = pattern.match(path)
+            if match:
+                route = name
+                break
+
+        with self.lock:
+            self.calls[(method, route or path)] += 1
+            try:
+                self.__fail()
+                if route is None:
+                    raise FakeConfluenceError(404, 'No route ' + path)
+                handler = getattr(self, '_{}_{}'.format(
+                    method.lower(), route), None)
+                if handler is None:
+                    raise FakeConfluenceError(405, 'Method not allowed')
+                status, data = handler(match.groupdict(), params,
+                                       content_type, body)
+                return status, {}, data
+            except FakeConfluenceError as ex:
+                self.errors[ex.status] += 1
+                return ex.status, ex.headers, {'statusCode': ex.status,
+                                               'message': ex.message}
+
+    def _get_content(self, match, params, content_type, body):
+        if 'title' in params:
+            page = self.find_page(params['title'])
+            pages = [page] if page is not None else []
+        else:
+            pages = list(self.pages.values())
+        return 200, self.results(
+            [self.page_json(page, params.get('expand', '')) for page in pages],
+            params)
+
+    def _post_content(self, match, params, content_type, body):
+        data = json.loads(body)
+        ancestors = data.get('ancestors') or [{}]
+        parent = ancestors[-1].get('id')
+        if parent is not None:
+            self.get_page(parent)
+        if self.find_page(data['title']) is not None:
+            raise FakeConfluenceError(
+                400, 'A page with this title already exists')
+        page = self.create_page(data['title'],
+                                data['body']['storage']['value'], parent)
+        return 200, self.page_json(page)
+
+    def _get_page(self, match, params, content_type, body):
+        page = self.get_page(match['id'])
+        return 200, self.page_json(page, params.get('expand', ''))
+
+    def _put_page(self, match, params, content_type, body):
+        page = self.get_page(match['id'])
+        data = json.loads(body)
+        if data['version']['number'] != page['version'] + 1:
+            raise FakeConfluenceError(409, 'Version must be incremented')
+        other = self.find_page(data['title'])
+        if other is not None and other is not page:
+            raise FakeConfluenceError(
+                400, 'A page with this title already exists')
+        ancestors = data.get('ancestors')
+        if ancestors:
+            parent = self.get_page(ancestors[-1]['id'])
+            if parent is page or any(ancestor['id'] == page['id']
+                                     for ancestor in self.ancestors(parent)):
+                raise FakeConfluenceError(
+                    400, 'A page cannot be moved under itself')
+            self.move_page(page, parent['id'])
+        self.rename_page(page, data['title'])
+        page['body'] = data['body']['storage']['value']
+        page['version'] += 1
+        return 200, self.page_json(page)
+
+    def _delete_page(self, match, params, content_type, body):
+        content_id = match['id']
+        if content_id in self.attachments:
+            del self.attachments[content_id]
+            return 204, None
+
+        page = self.get_page(content_id)
+        for attachment in list(self.attachments.values()):
+            if attachment['page'] == content_id:
+                del self.attachments[attachment['id']]
+        self.delete_page(page)
+        return 204, None
+
+    def _get_history(self, match, params, content_type, body):
+        page = self.get_page(match['id'])
+        return 200, {'latest': True,
+                     'lastUpdated': {'number': page['version']}}
+
+    def _get_descendants(self, match, params, content_type, body):
+        self.get_page(match['id'])
+        return 200, self.results(
+            [self.page_json(page, params.get('expand', ''))
+             for page in self.descendants(match['id'])], params)
+
+    def _get_children(self, match, params, content_type, body):
+        self.get_page(match['id'])
+        return 200, self.results(
+            [self.page_json(page) for page in self.children(match['id'])],
+            params)
+
+    def _get_attachments(self, match, params, content_type, body):
+        self.get_page(match['id'])
+        attachments = [
+            self.attachment_json(attachment)
+            for attachment in self.attachments.values()
+            if attachment['page'] == match['id']
+            and params.get('filename', attachment['title'])
+            == attachment['title']]
+        return 200, self.results(attachments, params)
+
+    def __upload(self, content_type, body):
+        message = email.parser.BytesParser(
+            policy=email.policy.default).parsebytes(
+            b'Content-Type: ' + content_type.encode('latin-1')
+            + b'\r\n\r\n' + body)
+        for part in message.iter_parts():
+            if part.get_filename():
+                return part.get_filename(), len(part.get_content())
+        raise FakeConfluenceError(400, 'No file in request')
+
+    def _post_attachments(self, match, params, content_type, body):
+        self.get_page(match['id'])
+        name, size = self.__upload(content_type, body)
+        attachment = {'id': 'att{}'.format(next(self.ids)), 'title': name,
+                      'page': match['id'], 'version': 1, 'size': size}
+        self.attachments[attachment['id']] = attachment
+        return 200, {'results': [self.attachment_json(attachment)],
+                     'size': 1}
+
+    def _post_attachment(self, match, params, content_type, body):
+        self.get_page(match['id'])
+        attachment = self.attachments.get(match['att'])
+        if attachment is None or attachment['page'] != match['id']:
+            raise FakeConfluenceError(404, 'No attachment ' + match['att'])
+        attachment['title'], attachment['size'] = \
+            self.__upload(content_type, body)
+        attachment['version'] += 1
+        return 200, self.attachment_json(attachment)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8090,
+                        help='default=8090. Port listening on 127.0.0.1')
+    parser.add_argument('--space', default='TEST',
+                        help='default=TEST. Space key')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='default=0. Seconds added to each request')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='default=0. Share of requests failing (5xx)')
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='default=0. Share of requests throttled (429)')
+    parser.add_argument('--retry-after', type=int, default=1,
+                        help='default=1. Retry-After of throttled requests')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='default=0. Random seed of failures')
+    args = parser.parse_args()
+
+    fake = FakeConfluence(args.space, args.latency, args.error_rate,
+                          args.throttle_rate, args.retry_after, args.seed,
+                          args.port)
+    fake.start()
+    print('URL => ' + fake.url + ', Space: ' + fake.space
+          + ', Parent Page Id: ' + fake.root_id)
+    try:
+        fake.thread.join()
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
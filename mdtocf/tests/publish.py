@@ -0,0 +1,289 @@
+"""Publishing Checks
+
+Runs ConfluencePublisher against a fake Confluence (see
+fake_confluence.py) on small trees written for each check:
+
+- noop: publishing an unchanged tree again makes no API calls.
+- ref-title: renaming the title of a Hugo ref link target renders again
+  and updates the pages linking to it.
+- since-rename: a page renamed in git and published with --since keeps
+  its Confluence page (same id) under its new parent.
+- since-index-removed: an _index.md removed in git and published with
+  --since turns its page into an autoindex page, links updated.
+- resume: --resume --force-update after an interrupted run only updates
+  the pages the interrupted run did not.
+- parent-removed: a page whose parent page was removed in Confluence
+  publishes its parent page again.
+- include-outside: editing a file included from outside markdown_dir
+  updates the page including it.
+- index-removed: removing the _index.md of a directory turns its page
+  into an autoindex page and updates the pages linking to it.
+- include-removed: removing an included (non markdown) file updates the
+  page including it.
+
+Each check prints OK or FAIL, the exit code is the number of failures.
+
+Usage: python -m mdtocf.tests.publish [check ...]
+
+"""
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+
+from mdtocf.ConfluencePublisher import ConfluencePublisher
+from mdtocf.tests.fake_confluence import FakeConfluence
+
+
+class CheckError(Exception):
+    pass
+
+
+def check(condition, message, *args):
+    if not condition:
+        raise CheckError(message.format(*args))
+
+
+def write_page(path, title, text=''):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write('---\ntitle: {}\n---\n\n{}\n'.format(title, text))
+
+
+def publish(fake, tree_dir, db_path, **kwargs):
+    publisher = ConfluencePublisher(
+        fake.url, 'check', 'check', '', tree_dir, db_path, fake.space,
+        fake.root_id, **kwargs)
+    publisher.delete()
+    publisher.publish()
+    return publisher
+
+
+def calls(publisher, method=None):
+    return sum(count for endpoint, count in publisher.api_calls()
+               if method is None or endpoint.startswith(method + ' '))
+
+
+def find_page(fake, title):
+    page = fake.find_page(title)
+    check(page is not None, 'page {!r} not found', title)
+    return page
+
+
+def check_noop(fake, workdir):
+    tree_dir = os.path.join(workdir, 'tree')
+    db_path = os.path.join(workdir, 'meta.db')
+    write_page(os.path.join(tree_dir, 'a.md'), 'A',
+               '[b]({{< ref "/B/b.md" >}})')
+    write_page(os.path.join(tree_dir, 'B', 'b.md'), 'Page B')
+    write_page(os.path.join(tree_dir, 'B', 'c.md'), 'Page C')
+
+    check(calls(publish(fake, tree_dir, db_path)) > 0,
+          'first publish made no calls')
+    count = calls(publish(fake, tree_dir, db_path))
+    check(count == 0, 'no-op publish made {} calls', count)
+
+
+def check_ref_title(fake, workdir):
+    tree_dir = os.path.join(workdir, 'tree')
+    db_path = os.path.join(workdir, 'meta.db')
+    write_page(os.path.join(tree_dir, 'a.md'), 'A',
+               '[b]({{< ref "/b.md" >}})')
+    write_page(os.path.join(tree_dir, 'b.md'), 'Old Target')
+    write_page(os.path.join(tree_dir, 'c.md'), 'C')
+    publish(fake, tree_dir, db_path)
+    check('Old Target' in find_page(fake, 'A')['body'],
+          'link title not rendered')
+
+    write_page(os.path.join(tree_dir, 'b.md'), 'New Target')
+    publisher = publish(fake, tree_dir, db_path)
+    check('New Target' in find_page(fake, 'A')['body'],
+          'dependent page not updated with the new target title')
+    rendered = sorted(path for path, phases
+                      in publisher.run_report()['pages'].items()
+                      if 'render' in phases)
+    check(rendered == ['a.md', 'b.md'],
+          'rendered {}, expected a.md and b.md', rendered)
+
+
+def git(tree_dir, *args):
+    subprocess.run(['git', '-c', 'user.name=check',
+                    '-c', 'user.email=check@example.com'] + list(args),
+                   cwd=tree_dir, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def check_since_rename(fake, workdir):
+    tree_dir = os.path.join(workdir, 'tree')
+    db_path = os.path.join(workdir, 'meta.db')
+    write_page(os.path.join(tree_dir, 'a.md'), 'Moved')
+    write_page(os.path.join(tree_dir, 'B', '_index.md'), 'Folder B')
+    git(tree_dir, 'init', '-q')
+    git(tree_dir, 'add', '.')
+    git(tree_dir, 'commit', '-q', '-m', 'Pages')
+    publish(fake, tree_dir, db_path)
+    page_id = find_page(fake, 'Moved')['id']
+
+    git(tree_dir, 'mv', 'a.md', os.path.join('B', 'a.md'))
+    git(tree_dir, 'commit', '-q', '-m', 'Move')
+    publish(fake, tree_dir, db_path, since='HEAD~1')
+    page = find_page(fake, 'Moved')
+    check(page['id'] == page_id, 'page id {} changed to {}',
+          page_id, page['id'])
+    check(page['parent'] == find_page(fake, 'Folder B')['id'],
+          'page not moved under its new parent')
+
+
+def check_since_index_removed(fake, workdir):
+    tree_dir = os.path.join(workdir, 'tree')
+    db_path = os.path.join(workdir, 'meta.db')
+    write_page(os.path.join(tree_dir, 'example.md'), 'Example',
+               '[a]({{< relref "./A" >}})')
+    write_page(os.path.join(tree_dir, 'A', '_index.md'), 'Folder A')
+    write_page(os.path.join(tree_dir, 'A', 'aa.md'), 'Page AA')
+    git(tree_dir, 'init', '-q')
+    git(tree_dir, 'add', '.')
+    git(tree_dir, 'commit', '-q', '-m', 'Pages')
+    publish(fake, tree_dir, db_path)
+    page_id = find_page(fake, 'Folder A')['id']
+
+    git(tree_dir, 'rm', '-q', os.path.join('A', '_index.md'))
+    publish(fake, tree_dir, db_path, since='HEAD')
+    check(fake.find_page('Folder A') is None, 'Folder A not renamed')
+    check(find_page(fake, 'A')['id'] == page_id,
+          'autoindex page A is not the page of Folder A')
+    body = find_page(fake, 'Example')['body']
+    check('Folder A' not in body and 'ri:content-title="A"' in body,
+          'link not updated to the autoindex page: {}', body)
+
+
+def check_resume(fake, workdir):
+    tree_dir = os.path.join(workdir, 'tree')
+    db_path = os.path.join(workdir, 'meta.db')
+    for name in ('a', 'b', 'c', 'z'):
+        write_page(os.path.join(tree_dir, name + '.md'), name.upper())
+    publish(fake, tree_dir, db_path)
+
+    # Interrupted after a, b and c (z, last published, is broken)
+    broken = os.path.join(tree_dir, 'z.md')
+    with open(broken, 'w', encoding='utf-8') as file:
+        file.write('No front matter\n')
+    try:
+        publish(fake, tree_dir, db_path, force_update=True)
+    except Exception:
+        pass
+    else:
+        raise CheckError('broken page published')
+
+    write_page(broken, 'Z')
+    publisher = publish(fake, tree_dir, db_path, force_update=True,
+                        resume=True)
+    count = calls(publisher, 'PUT')
+    check(count == 1, 'resumed run updated {} pages, expected 1', count)
+
+
+def check_parent_removed(fake, workdir):
+    tree_dir = os.path.join(workdir, 'tree')
+    db_path = os.path.join(workdir, 'meta.db')
+    write_page(os.path.join(tree_dir, 'A', '_index.md'), 'Folder A')
+    write_page(os.path.join(tree_dir, 'A', 'aa.md'), 'Page AA')
+    publish(fake, tree_dir, db_path)
+    fake.delete_page(find_page(fake, 'Folder A'))
+
+    write_page(os.path.join(tree_dir, 'A', 'aa.md'), 'Page AA', 'Edited')
+    publish(fake, tree_dir, db_path)
+    page = find_page(fake, 'Page AA')
+    check('Edited' in page['body'], 'page not updated')
+    check(page['parent'] == find_page(fake, 'Folder A')['id'],
+          'page not moved under its parent published again')
+
+
+def check_include_outside(fake, workdir):
+    tree_dir = os.path.join(workdir, 'tree')
+    db_path = os.path.join(workdir, 'meta.db')
+    shared = os.path.join(workdir, 'shared.md')
+    write_page(os.path.join(tree_dir, 'a.md'), 'A',
+               '.. include:: ../shared.md')
+    with open(shared, 'w', encoding='utf-8') as file:
+        file.write('Old shared text\n')
+    publish(fake, tree_dir, db_path)
+    check('Old shared text' in find_page(fake, 'A')['body'],
+          'included text not rendered')
+
+    with open(shared, 'w', encoding='utf-8') as file:
+        file.write('New shared text\n')
+    publish(fake, tree_dir, db_path)
+    check('New shared text' in find_page(fake, 'A')['body'],
+          'page not updated with the new included text')
+
+
+def check_index_removed(fake, workdir):
+    tree_dir = os.path.join(workdir, 'tree')
+    db_path = os.path.join(workdir, 'meta.db')
+    write_page(os.path.join(tree_dir, 'example.md'), 'Example',
+               '[a]({{< relref "./A" >}})')
+    write_page(os.path.join(tree_dir, 'A', '_index.md'), 'Folder A')
+    write_page(os.path.join(tree_dir, 'A', 'aa.md'), 'Page AA')
+    publish(fake, tree_dir, db_path)
+    page_id = find_page(fake, 'Folder A')['id']
+
+    os.remove(os.path.join(tree_dir, 'A', '_index.md'))
+    publish(fake, tree_dir, db_path)
+    check(fake.find_page('Folder A') is None, 'Folder A not renamed')
+    check(find_page(fake, 'A')['id'] == page_id,
+          'autoindex page A is not the page of Folder A')
+    body = find_page(fake, 'Example')['body']
+    check('Folder A' not in body and 'ri:content-title="A"' in body,
+          'link not updated to the autoindex page: {}', body)
+
+
+def check_include_removed(fake, workdir):
+    tree_dir = os.path.join(workdir, 'tree')
+    db_path = os.path.join(workdir, 'meta.db')
+    snip = os.path.join(tree_dir, 'snip.html')
+    write_page(os.path.join(tree_dir, 'a.md'), 'A',
+               '.. include:: snip.html')
+    with open(snip, 'w', encoding='utf-8') as file:
+        file.write('<p>Snippet</p>\n')
+    publish(fake, tree_dir, db_path)
+    check('Snippet' in find_page(fake, 'A')['body'],
+          'included snippet not rendered')
+
+    os.remove(snip)
+    publish(fake, tree_dir, db_path)
+    check('Snippet' not in find_page(fake, 'A')['body'],
+          'page still includes the removed snippet')
+
+
+CHECKS = {
+    'noop': check_noop,
+    'ref-title': check_ref_title,
+    'since-rename': check_since_rename,
+    'since-index-removed': check_since_index_removed,
+    'resume': check_resume,
+    'parent-removed': check_parent_removed,
+    'include-outside': check_include_outside,
+    'index-removed': check_index_removed,
+    'include-removed': check_include_removed,
+}
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    names = sys.argv[1:] or list(CHECKS)
+    failures = 0
+    for name in names:
+        with tempfile.TemporaryDirectory() as workdir, \
+                FakeConfluence() as fake:
+            try:
+                CHECKS[name](fake, workdir)
+                print('OK   => {}'.format(name))
+            except Exception as ex:
+                failures += 1
+                print('FAIL => {}: {!r}'.format(name, ex))
+    sys.exit(failures)
+
+
+if __name__ == "__main__":
+    main()
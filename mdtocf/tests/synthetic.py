@@ -0,0 +1,136 @@
+"""Synthetic Markdown Trees
+
+Generates a markdown directory of any size for benchmarks, with a
+configurable density of Hugo ref links, code blocks, tables, admonitions
+and attachments. The same arguments (and seed) generate the same tree.
+
+Usage: python -m mdtocf.tests.synthetic DIR --pages 1000
+
+"""
+import argparse
+import os
+import random
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do '
+         'eiusmod tempor incididunt ut labore et dolore magna aliqua').split()
+
+ADMONITIONS = ('tip', 'info', 'note', 'warning')
+
+
+def chunk_dir(chunk, fanout):
+    # Chunk 0 is the root, chunk 25 (fanout 20) is d1/d5
+    parts = []
+    while chunk:
+        parts.insert(0, 'd{}'.format(chunk % fanout))
+        chunk //= fanout
+    return '/'.join(parts)
+
+
+def page_path(page, fanout):
+    directory = chunk_dir(page // fanout, fanout)
+    name = 'page_{}.md'.format(page)
+    return directory + '/' + name if directory else name
+
+
+def sentence(rnd, words=12):
+    return ' '.join(rnd.choice(WORDS) for i in range(words)).capitalize() \
+        + '.'
+
+
+def generate_page(rnd, page, pages, ref_links, code_blocks, tables,
+                  admonitions, attachment, fanout):
+    lines = ['---', 'title: Page {}'.format(page), '---', '',
+             '# Page {}'.format(page), '', sentence(rnd, 40), '']
+
+    for i in range(ref_links):
+        target = page_path(rnd.randrange(pages), fanout)
+        lines += ['[See page]({{{{< ref "/{}" >}}}})'.format(target), '']
+
+    for i in range(code_blocks):
+        lines += ['``` python',
+                  'def function_{}(value):'.format(i),
+                  '    return value * {}'.format(rnd.randrange(100)),
+                  '```', '']
+
+    for i in range(tables):
+        lines += ['| Key | Value |', '| --- | ----- |']
+        lines += ['| {} | {} |'.format(rnd.choice(WORDS), sentence(rnd, 4))
+                  for row in range(5)]
+        lines += ['']
+
+    for i in range(admonitions):
+        lines += ['.. {}::{}'.format(rnd.choice(ADMONITIONS),
+                                     rnd.choice(WORDS).title()),
+                  '   ' + sentence(rnd), '']
+
+    if attachment:
+        lines += ['![Image](page_{}.png)'.format(page), '']
+
+    lines += [sentence(rnd, 60), '']
+    return '\n'.join(lines)
+
+
+def generate_tree(path, pages, ref_links=2, code_blocks=1, tables=1,
+                  admonitions=1, attachments=0.05, fanout=20, seed=0):
+    rnd = random.Random(seed)
+    for chunk in range((pages + fanout - 1) // fanout):
+        directory = os.path.join(path, chunk_dir(chunk, fanout))
+        os.makedirs(directory, exist_ok=True)
+        if chunk:
+            with open(os.path.join(directory, '_index.md'), 'w',
+                      encoding='utf-8') as file:
+                file.write('---\ntitle: Section {}\n---\n\n{}\n'.format(
+                    chunk, sentence(rnd)))
+
+    for page in range(pages):
+        filepath = os.path.join(path, page_path(page, fanout))
+        attachment = rnd.random() < attachments
+        with open(filepath, 'w', encoding='utf-8') as file:
+            file.write(generate_page(
+                rnd, page, pages, ref_links, code_blocks, tables,
+                admonitions, attachment, fanout))
+        if attachment:
+            image = os.path.join(os.path.dirname(filepath),
+                                 'page_{}.png'.format(page))
+            with open(image, 'wb') as file:
+                file.write(bytes(rnd.getrandbits(8)
+                                 for i in range(rnd.randrange(1024, 4096))))
+
+
+def add_tree_arguments(parser):
+    parser.add_argument('--ref-links', type=int, default=2,
+                        help='default=2. Hugo ref links per page')
+    parser.add_argument('--code-blocks', type=int, default=1,
+                        help='default=1. Code blocks per page')
+    parser.add_argument('--tables', type=int, default=1,
+                        help='default=1. Tables per page')
+    parser.add_argument('--admonitions', type=int, default=1,
+                        help='default=1. Admonitions per page')
+    parser.add_argument('--attachments', type=float, default=0.05,
+                        help='default=0.05. Share of pages with an image')
+    parser.add_argument('--fanout', type=int, default=20,
+                        help='default=20. Pages and directories per directory')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='default=0. Random seed')
+
+
+def tree_arguments(args):
+    return {'ref_links': args.ref_links, 'code_blocks': args.code_blocks,
+            'tables': args.tables, 'admonitions': args.admonitions,
+            'attachments': args.attachments, 'fanout': args.fanout,
+            'seed': args.seed}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', help='Directory to generate')
+    parser.add_argument('--pages', type=int, default=100,
+                        help='default=100. Number of pages')
+    add_tree_arguments(parser)
+    args = parser.parse_args()
+
+    generate_tree(args.path, args.pages, **tree_arguments(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 def getFileContent(filepath):
     try:
-        with open(filepath, 'r') as file:
+        with open(filepath, 'r', encoding='utf-8') as file:
             content = file.read()
     except FileNotFoundError:
         content = ''